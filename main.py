@@ -1,108 +1,100 @@
 import asyncio
+import aiohttp
 
 # Logger
 import logging
 from logging.handlers import RotatingFileHandler
 from tools.logger import PrettyFormatter
 
-from tools.gmail import Gmail
-from tools.processor import Processor
+from tools.gmail_async import AsyncGmail, GmailException
+from tools.processor import Processor, SAFETY_NET_POLL
+from tools.scheduler import PollScheduler, wait_for_event
+from tools.sender import Sender
 # from tools.chatbot import ChatBot
 
-import time
 import os
 
 stop_event = asyncio.Event()
 
+# Longest the fetch loop waits between two polls once idle, in seconds. Set MEEP_FETCH_POLL_CEILING=5
+# on deployments where a text after a quiet spell must be picked up as fast as the old fixed poll did
+FETCH_POLL_CEILING = float(os.environ.get("MEEP_FETCH_POLL_CEILING", 60))
+
 async def gmail_fetch_loop(stop_event: asyncio.Event):
     """
-    Continuously checks Gmail for new messages.
-    Switches between IDLE and ACTIVE modes automatically.
-    - IDLE mode: Checks less frequently.
-    - ACTIVE mode: Fetches new emails and adds them to the sql database.
+    Continuously checks Gmail for new messages and adds them to the sql database.
+    Polls quickly while messages keep coming in and backs off exponentially when idle.
+    Pauses while the processor is too far behind (inbox above its high watermark).
     """
 
-    loop = asyncio.get_running_loop()
-    state = "IDLE"
-    last_activity = time.time()
-
     logger.info("[Gmail Fetch Loop] Initialized gmail fetch loop.")
 
     try:
         while not stop_event.is_set():
-            # Check Gmail inbox in a thread-safe way
-            has_new = await loop.run_in_executor(None, gmail_client.check_inbox)
-
-            # INACTIVE MODE
-            if not has_new:
-                # No new work for over one minute -> INACTIVE
-                if state != "INACTIVE" and time.time() - last_activity > 1 * 60:
-                    logger.info("[Gmail Fetch Loop] No new messages for a while — switching to INACTIVE mode.")
-                    state = "INACTIVE"
-                await asyncio.sleep(5)
+            await processor.wait_for_capacity(stop_event)
+
+            # Incrementally sync the Gmail inbox without blocking the event loop, new emails are
+            # committed to the inbox before gmail hears they were read.
+            # A failed sync (gmail 5xx, connection drop) is retried once the scheduler backs off.
+            try:
+                emails = await gmail_client.sync_inbox(10, processor.add_emails_to_inbox)
+            except (GmailException, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"[Gmail Fetch Loop] Sync failed, retrying: {e}")
+                fetch_scheduler.record(False)
+                await fetch_scheduler.wait()
                 continue
+            fetch_scheduler.record(bool(emails))
 
-            # There is work → ACTIVE
-            if has_new and state != "ACTIVE":
-                logger.info("[Gmail Fetch Loop] New messages detected — switching to ACTIVE mode.")
-                state = "ACTIVE"
-            
-            # Do work here
-            emails = gmail_client.get_unread_emails(10)
-            await processor.add_emails_to_inbox(emails)
-            last_activity = time.time()
-
-            # Small delay to prevent tight loop
-            await asyncio.sleep(0.5)
+            await fetch_scheduler.wait()
     except Exception as e:
         logger.exception(f"[Gmail Fetch Loop] Unexpected error: {e}")
 
-async def gmail_send_loop(stop_event: asyncio.Event):
+async def gmail_relabel_loop(stop_event: asyncio.Event, interval : float = 60):
     """
-    Continuously checks Gmail for new messages.
-    Switches between IDLE and ACTIVE modes automatically.
-    - IDLE mode: Checks less frequently.
-    - ACTIVE mode: Fetches new emails and adds them to the sql database.
+    Retries removing the UNREAD label of ingested messages where that failed after the fetch.
+    The seen table keeps them from being downloaded again in the meantime.
     """
 
-    loop = asyncio.get_running_loop()
-    state = "IDLE"
-    last_activity = time.time()
+    logger.info("[Gmail Relabel Loop] Initialized gmail relabel loop.")
 
-    logger.info("[Gmail Fetch Loop] Initialized gmail fetch loop.")
+    try:
+        while not stop_event.is_set():
+            gmail_msg_ids = await processor.seen.pending_relabels()
+            if gmail_msg_ids:
+                failed = await gmail_client.mark_as_read(gmail_msg_ids)
+                await processor.seen.relabeled([i for i in gmail_msg_ids if i not in failed], failed)
+                logger.info(f"[Gmail Relabel Loop] Removed UNREAD from {len(gmail_msg_ids) - len(failed)} of {len(gmail_msg_ids)} message(s)")
+            await processor.seen.prune()
+
+            await wait_for_event(stop_event, interval)
+    except Exception as e:
+        logger.exception(f"[Gmail Relabel Loop] Unexpected error: {e}")
+
+async def gmail_send_loop(stop_event: asyncio.Event):
+    """
+    Continuously sends the replies queued in the outbox.
+    Woken up by the processor whenever a reply is queued, polls the outbox as a safety net.
+    """
+
+    logger.info("[Gmail Send Loop] Initialized gmail send loop.")
 
     try:
         while not stop_event.is_set():
-            emails = await processor.get_outgoing_emails(10)
-
-            # INACTIVE MODE
-            if not emails:
-                # No new work for over one minute -> INACTIVE
-                if state != "INACTIVE" and time.time() - last_activity > 1 * 60:
-                    logger.info("[Gmail Send Loop] No outgoing messages for a while — switching to INACTIVE mode.")
-                    state = "INACTIVE"
-                await asyncio.sleep(5)
-                continue
+            send_scheduler.begin()
+            emails = await sender.claim(10)
+            send_scheduler.record(bool(emails))
 
-            # There is work → ACTIVE
-            if emails and state != "ACTIVE":
-                logger.info("[Gmail Send Loop] New outgoing messages detected — switching to ACTIVE mode.")
-                state = "ACTIVE"
-            
-            # Do work here
-            for email_obj in emails:
-                await loop.run_in_executor(None, gmail_client.reply_message, email_obj)
-            await processor.remove_from_outbox(emails)
-            last_activity = time.time()
-
-            # Small delay to prevent tight loop
-            await asyncio.sleep(0.5)
+            # Do work here, each claimed outbox row is acked as soon as its reply went out
+            if emails:
+                await sender.send_all(emails)
+
+            await send_scheduler.wait()
     except Exception as e:
-        logger.exception(f"[Gmail Fetch Loop] Unexpected error: {e}")
+        logger.exception(f"[Gmail Send Loop] Unexpected error: {e}")
 
 async def main():
     # set up necessary variables
-    global chatbot, logger, gmail_client, processor
+    global chatbot, logger, gmail_client, processor, sender, fetch_scheduler, send_scheduler
     log_path = os.path.join(os.getcwd(), "logs", "MEEP.log")
 
     # Configure logger
@@ -122,17 +114,30 @@ async def main():
     logger.addHandler(handler)
     logger.info("---------- Initialized logger object, script is running :) ----------")
 
-    # Configure gmail service
-    gmail_client = Gmail(logger)
+    # Configure gmail client
+    gmail_client = await AsyncGmail.create(logger)
 
     # 
     processor = await Processor.create(logger)
+    # Skip messages that were already ingested before downloading them
+    gmail_client.seen = processor.seen
+
+    # Concurrent, rate limited reply sender
+    sender = Sender(gmail_client, processor, logger)
+
+    # Poll gmail every 0.5s while texts keep coming in, backing off to FETCH_POLL_CEILING when idle.
+    # An idle poll is a single history.list call, 2 quota units.
+    # The send loop is woken up by the processor, its polling is only a safety net.
+    fetch_scheduler = PollScheduler("Gmail Fetch Loop", logger, floor=0.5, ceiling=FETCH_POLL_CEILING)
+    send_scheduler = PollScheduler("Gmail Send Loop", logger, floor=0.5, ceiling=SAFETY_NET_POLL, wake_event=processor.outbox_ready)
 
     gmail_fetch_task = asyncio.create_task(gmail_fetch_loop(stop_event))
     gmail_send_task = asyncio.create_task(gmail_send_loop(stop_event))
+    gmail_relabel_task = asyncio.create_task(gmail_relabel_loop(stop_event))
     processor_task = asyncio.create_task(processor.process_loop(stop_event, 10))
+    notion_spool_task = asyncio.create_task(processor.spool.run(stop_event))
     try:
-        await asyncio.gather(gmail_fetch_task, gmail_send_task, processor_task)
+        await asyncio.gather(gmail_fetch_task, gmail_send_task, gmail_relabel_task, processor_task, notion_spool_task)
     except asyncio.CancelledError:
         stop_event.set()
         logger.info("[Main] Gmail loop cancelled — cleaning up.")
@@ -143,7 +148,14 @@ async def main():
         logger.exception("[Main] Exception:")
     finally:
         # ensure all async resources are properly closed
+        logger.info(f"[Main] Database stats: {processor.db_stats}, inbox queue stats: {processor.queue_stats}")
+        logger.info(f"[Main] Deepest sender backlogs: {await processor.sender_depths()}, chat sessions: {processor.session_stats}, seen messages: {processor.seen.metrics()}")
+        logger.info(f"[Main] Notion client stats: {processor.notion_stats}, spool stats: {processor.spool_stats}, spool depth: {await processor.spool.depth()}")
         await processor.terminate()
+        await gmail_client.terminate()
+        logger.info(f"[Main] Gmail service cache stats: {gmail_client.service_stats}")
+        logger.info(f"[Main] Gmail quota stats: {gmail_client.quota.stats}, sender stats: {sender.stats}")
+        logger.info(f"[Main] Poll stats: fetch {fetch_scheduler.metrics()}, send {send_scheduler.metrics()}, processor {processor.scheduler.metrics()}, notion spool {processor.spool.scheduler.metrics()}")
         logger.info("[Main] Shutdown complete.")
 
 if __name__ == "__main__":
@@ -0,0 +1,554 @@
+import os
+import time
+import random
+import datetime
+import sqlite3
+import asyncio
+import logging
+import aiosqlite
+from typing import Any, Awaitable, Callable, Optional
+
+class DatabaseException(Exception):
+    def __init__(self, *args: object) -> None:
+        super().__init__(*args)
+
+    def __str__(self) -> str:
+        return f"[!] Database Exception: {self.args[0]}"
+
+# Inbox and outbox live in one database so moving a message between them is a single transaction.
+# state/status are the queue columns every scan filters on, so they are indexed.
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS inbox (
+        content TEXT,
+        time_sent TEXT,
+        time_seen TEXT,
+        state TEXT NOT NULL CHECK (state IN ('unconfirmed', 'Command', 'Chat')),
+        sender TEXT,
+        subject TEXT,
+        msg_id TEXT PRIMARY KEY,
+        thread_id TEXT,
+        gmail_msg_id TEXT,
+        time_sent_ms INTEGER,
+        time_seen_ms INTEGER,
+        deferred_until INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS outbox (
+        content TEXT,
+        time_sent TEXT,
+        sender TEXT,
+        subject TEXT,
+        msg_id TEXT PRIMARY KEY,
+        thread_id TEXT,
+        gmail_msg_id TEXT,
+        status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sending', 'failed')),
+        lease_owner TEXT,
+        lease_expires INTEGER,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        time_sent_ms INTEGER,
+        reply_to TEXT
+    )
+    """,
+    # Gmail messages already ingested, see tools/seen.py
+    """
+    CREATE TABLE IF NOT EXISTS seen (
+        gmail_msg_id TEXT PRIMARY KEY,
+        msg_id TEXT,
+        seen_ms INTEGER NOT NULL,
+        unread_removed INTEGER NOT NULL DEFAULT 1,
+        attempts INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    # Chat sessions, see tools/sessions.py
+    """
+    CREATE TABLE IF NOT EXISTS sessions (
+        sender TEXT PRIMARY KEY,
+        thread_id TEXT,
+        mode TEXT NOT NULL CHECK (mode IN ('Chat')),
+        started_ms INTEGER NOT NULL,
+        expires_ms INTEGER NOT NULL
+    )
+    """,
+    # Notion writes waiting for a worker, see tools/spool.py
+    """
+    CREATE TABLE IF NOT EXISTS notion_spool (
+        idempotency_key TEXT PRIMARY KEY,
+        command TEXT NOT NULL,
+        time_sent TEXT,
+        sender TEXT,
+        subject TEXT,
+        msg_id TEXT,
+        thread_id TEXT,
+        gmail_msg_id TEXT,
+        time_sent_ms INTEGER,
+        status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'running', 'done', 'failed')),
+        lease_owner TEXT,
+        lease_expires INTEGER,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_ms INTEGER NOT NULL DEFAULT 0,
+        result TEXT,
+        queued_ms INTEGER NOT NULL,
+        finished_ms INTEGER,
+        taken_over INTEGER NOT NULL DEFAULT 0
+    )
+    """
+]
+
+# Columns added after a table was first shipped, added to older databases on connect
+ADDED_COLUMNS = {
+    "inbox": {"time_sent_ms": "INTEGER", "time_seen_ms": "INTEGER", "deferred_until": "INTEGER"},
+    "outbox": {"time_sent_ms": "INTEGER", "reply_to": "TEXT"},
+    "notion_spool": {"taken_over": "INTEGER NOT NULL DEFAULT 0"}
+}
+
+# Inbox priority lanes: '!' commands are read as if they were sent AGING_MS earlier than the
+# rest, so they jump ahead of a chat flood while older rows still come first (no starvation).
+# Lanes only order different senders: a sender's unconfirmed rows are classified in the order
+# they were sent (chat mode depends on it), see SENT_ORDER.
+# Queries must ORDER BY exactly LANE_ORDER (or SENT_ORDER) for the inbox_sender_lane
+# (inbox_sender_time) index to be used.
+AGING_MS = 5 * 60 * 1000
+LANE_ORDER = f"time_sent_ms + (CASE WHEN substr(content, 1, 1) = '!' THEN 0 ELSE {AGING_MS} END)"
+SENT_ORDER = "time_sent_ms"
+
+def fair_select(state : str, where : str = "1", order : str = LANE_ORDER, between : str = LANE_ORDER) -> str:
+    """
+    SELECT of inbox rows in state matching where, taking senders round robin: the first row
+    (in order) of every sender, then everyone's second row, and so on. Senders sharing a turn
+    go in between order. Uses named parameters, the row limit is :limit.
+    Senders are walked through the inbox_sender_lane index and each contributes at most
+    :limit rows, so the window only sorts (senders x limit) rows, not the whole backlog.
+    """
+    return f"""
+        WITH RECURSIVE senders(sender) AS (
+            SELECT MIN(sender) FROM inbox WHERE state = '{state}'
+            UNION ALL
+            SELECT (SELECT MIN(sender) FROM inbox WHERE state = '{state}' AND sender > senders.sender)
+            FROM senders WHERE senders.sender IS NOT NULL
+        )
+        SELECT * FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY sender ORDER BY {order}) AS sender_turn
+            FROM inbox WHERE rowid IN (
+                SELECT candidate.rowid FROM senders JOIN inbox AS candidate ON candidate.rowid IN (
+                    SELECT rowid FROM inbox
+                    WHERE state = '{state}' AND sender = senders.sender AND ({where})
+                    ORDER BY {order}
+                    LIMIT :limit
+                )
+            )
+        )
+        ORDER BY sender_turn, {between}
+        LIMIT :limit
+    """
+
+# Queues are read in lane order within a state, reports filter on time windows
+INDEXES = [
+    "DROP INDEX IF EXISTS inbox_state",
+    "CREATE INDEX IF NOT EXISTS inbox_state_time ON inbox (state, time_sent_ms)",
+    "DROP INDEX IF EXISTS inbox_lane",
+    f"CREATE INDEX IF NOT EXISTS inbox_sender_lane ON inbox (state, sender, {LANE_ORDER})",
+    f"CREATE INDEX IF NOT EXISTS inbox_sender_time ON inbox (state, sender, {SENT_ORDER})",
+    "CREATE INDEX IF NOT EXISTS inbox_time_sent ON inbox (time_sent_ms)",
+    "CREATE INDEX IF NOT EXISTS inbox_time_seen ON inbox (time_seen_ms)",
+    "CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, lease_expires)",
+    "CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires_ms)",
+    "CREATE INDEX IF NOT EXISTS seen_age ON seen (seen_ms)",
+    "CREATE INDEX IF NOT EXISTS seen_pending ON seen (seen_ms) WHERE unread_removed = 0",
+    "CREATE INDEX IF NOT EXISTS outbox_time_sent ON outbox (time_sent_ms)",
+    "CREATE INDEX IF NOT EXISTS notion_spool_due ON notion_spool (status, next_attempt_ms)"
+]
+
+# Display format of the time_sent / time_seen strings, see Gmail.parse_headers
+TIME_FORMAT = "%Y-%m-%d %I:%M:%S %p"
+BACKFILL_CHUNK = 500
+
+# PRAGMAs applied to every connection, override single keys through Database(profile=...)
+PERFORMANCE_PROFILE = {
+    "cache_size": -16000,           # negative is KiB, so 16 MB of page cache
+    "mmap_size": 64 * 1024 * 1024,  # read pages through a 64 MB memory map
+    "temp_store": "MEMORY",         # sorts and temp indexes stay off disk
+    "wal_autocheckpoint": 1000,     # pages, sqlite's own checkpoint on commit stays as a fallback
+    "journal_size_limit": 16 * 1024 * 1024, # shrink the WAL file back after a RESTART checkpoint
+    "busy_timeout": 10000           # ms to wait on a lock before raising "database is locked"
+}
+
+def to_epoch_ms(value : Optional[str]) -> Optional[int]:
+    """Parse a TIME_FORMAT string (local time) into epoch milliseconds, None if it does not parse"""
+    try:
+        return int(datetime.datetime.strptime(value, TIME_FORMAT).timestamp() * 1000) # type: ignore
+    except (TypeError, ValueError):
+        return None
+
+# The separate inbox.db / outbox.db files used before, and how to import their emails table
+LEGACY_IMPORTS = {
+    "inbox.db": lambda columns: """
+        INSERT OR IGNORE INTO inbox
+        (content, time_sent, time_seen, state, sender, subject, msg_id, thread_id, gmail_msg_id)
+        SELECT content, time_sent, time_seen, type, sender, subject, msg_id, thread_id, gmail_msg_id
+        FROM legacy.emails
+    """,
+    "outbox.db": lambda columns: f"""
+        INSERT OR IGNORE INTO outbox
+        (content, time_sent, sender, subject, msg_id, thread_id, gmail_msg_id, status)
+        SELECT content, time_sent, sender, subject, msg_id, thread_id, gmail_msg_id,
+            {"CASE WHEN status = 'failed' THEN 'failed' ELSE 'pending' END" if "status" in columns else "'pending'"}
+        FROM legacy.emails
+    """
+}
+
+def is_locked(error : Exception) -> bool:
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in str(error).lower() or "busy" in str(error).lower())
+
+async def retry_locked(operation : Callable[[], Awaitable[Any]], logger : logging.Logger, retries=5, delay=0.5) -> Any:
+    """Await operation(), retrying with jitter while the database is locked. Returns None on failure."""
+    for _ in range(retries):
+        try:
+            return await operation()
+        except sqlite3.Error as e:
+            if not is_locked(e):
+                logger.exception(f"[Database] ")
+                return None
+            await asyncio.sleep(delay + random.random() * 0.2)
+        except Exception:
+            logger.exception(f"[Database] ")
+            return None
+    logger.error(f"[Database] Database stayed locked after {retries} tries, giving up")
+    return None
+
+'''
+ReaderPool: read-only connections for SELECTs, so reads never queue behind the writer's commits
+- size: number of connections, each on its own aiosqlite thread
+- stats: reads served, and how many had to wait for a free connection
+'''
+class ReaderPool:
+    def __init__(self, db : 'Database', size : int = 3) -> None:
+        self.size = size
+        self.stats = {"reads": 0, "waits": 0}
+        self._db = db
+        self._idle : asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._conns : list[aiosqlite.Connection] = []
+
+    async def open(self) -> None:
+        # mode=ro: a reader can never take the write lock, WAL lets it read next to the writer
+        for _ in range(self.size):
+            conn = await aiosqlite.connect(f"file:{self._db.path}?mode=ro", uri=True)
+            await self._db.apply_profile(conn)
+            conn.row_factory = aiosqlite.Row
+            self._conns.append(conn)
+            self._idle.put_nowait(conn)
+
+    async def read(self, query : str, params : tuple | dict = (), retries=5, delay=0.5) -> Optional[list]:
+        """Run a SELECT on a free reader and fetch all rows, None on failure"""
+        async def fetch():
+            if self._idle.empty():
+                self.stats["waits"] += 1
+            conn = await self._idle.get()
+            try:
+                cursor = await conn.execute(query, params)
+                return await cursor.fetchall()
+            finally:
+                self._idle.put_nowait(conn)
+
+        self.stats["reads"] += 1
+        return await retry_locked(fetch, self._db.logger, retries, delay)
+
+    async def close(self) -> None:
+        for conn in self._conns:
+            await conn.close()
+        self._conns = []
+
+'''
+Checkpointer: background WAL checkpoints, so a long running process does not grow the WAL forever
+- interval: seconds between WAL size checks
+- passive_bytes: WAL size from which a PASSIVE checkpoint runs even while busy
+- restart_bytes: WAL size from which a RESTART checkpoint runs once the database is idle
+- idle_seconds: no statement for this long counts as idle, idle databases get checkpointed too
+'''
+class Checkpointer:
+    def __init__(self, db : 'Database', interval : float = 5, passive_bytes : int = 1024 * 1024, restart_bytes : int = 16 * 1024 * 1024, idle_seconds : float = 2) -> None:
+        self.interval = interval
+        self.passive_bytes = passive_bytes
+        self.restart_bytes = restart_bytes
+        self.idle_seconds = idle_seconds
+        self._db = db
+        self._last_checkpoint = 0.0
+        self._clean = False
+
+    def pick_mode(self, wal_bytes : int, idle : float) -> Optional[str]:
+        """Checkpoint mode for the current WAL size and idle time, None to skip this round"""
+        # Nothing was written since the last complete checkpoint
+        if wal_bytes == 0 or (self._clean and self._db.last_write < self._last_checkpoint):
+            return None
+        if idle >= self.idle_seconds:
+            # RESTART waits for readers, so only while idle. It makes the next writer
+            # start over at the beginning of the WAL, which caps its size.
+            return "RESTART" if wal_bytes >= self.restart_bytes else "PASSIVE"
+        if wal_bytes >= self.passive_bytes:
+            return "PASSIVE"
+        return None
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            mode = self.pick_mode(self._db.wal_size(), time.monotonic() - self._db.last_activity)
+            if not mode:
+                continue
+            self._last_checkpoint = time.monotonic()
+            result = await self._db.checkpoint(mode)
+            # (busy, WAL frames, frames checkpointed), the WAL is clean if everything got copied
+            self._clean = bool(result) and not result[0] and result[1] == result[2] # type: ignore
+
+'''
+Database:
+- logger: log info and errors log files
+- path: the sqlite file holding the inbox and outbox tables
+- profile: PRAGMAs applied to every connection, PERFORMANCE_PROFILE with overrides
+- last_activity / last_write: monotonic time of the last statement / write, for the checkpointer
+- stats: checkpoint counts and durations
+- readers: pool of read-only connections, see read()
+- _conn: the single writer connection (its own thread), rows come back as aiosqlite.Row
+- _tasks: background tasks (timestamp backfill, checkpointer), cancelled on close
+'''
+class Database:
+    def __init__(self, logger : logging.Logger, path : Optional[str] = None, profile : Optional[dict] = None, readers : int = 3) -> None:
+        self.logger : logging.Logger = logger
+        self.dir_path = os.path.join(os.getcwd(), "memory")
+        self.path = path or os.path.join(self.dir_path, "meep.db")
+        unknown = set(profile or {}) - set(PERFORMANCE_PROFILE)
+        if unknown:
+            raise DatabaseException(f"Unknown performance profile settings {sorted(unknown)}")
+        self.profile = {**PERFORMANCE_PROFILE, **(profile or {})}
+        self.checkpointer = Checkpointer(self)
+        self.readers = ReaderPool(self, readers)
+        self.last_activity = time.monotonic()
+        self.last_write = time.monotonic()
+        self.stats = {"checkpoints": 0, "passive": 0, "restart": 0, "busy": 0, "checkpoint_time": 0.0, "max_checkpoint_time": 0.0}
+        self._conn : aiosqlite.Connection
+        self._tasks : list[asyncio.Task] = []
+
+    @classmethod
+    async def create(cls, logger : logging.Logger, path : Optional[str] = None, profile : Optional[dict] = None, readers : int = 3, retries=5, delay=0.5) -> 'Database':
+        db_obj = cls(logger, path, profile, readers)
+        for _ in range(retries):
+            try:
+                await db_obj.connect()
+                return db_obj
+            except aiosqlite.OperationalError as e:
+                if "locked" not in str(e).lower():
+                    raise DatabaseException(e)
+                await asyncio.sleep(delay)
+        raise DatabaseException(f"{db_obj.path} stayed locked during setup.")
+
+    async def connect(self) -> None:
+        """Open the writer, enable WAL mode, create the schema, import legacy databases and open the readers"""
+        self._conn = await aiosqlite.connect(self.path, timeout=10)
+        await self._conn.execute("PRAGMA journal_mode=WAL;")
+        await self._conn.execute("PRAGMA synchronous=NORMAL;")
+        await self.apply_profile(self._conn)
+        for statement in SCHEMA:
+            await self._conn.execute(statement)
+        for table, columns in ADDED_COLUMNS.items():
+            cursor = await self._conn.execute(f"PRAGMA table_info({table})")
+            existing = {row[1] for row in await cursor.fetchall()}
+            for column, column_type in columns.items():
+                if column not in existing:
+                    await self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        for statement in INDEXES:
+            await self._conn.execute(statement)
+        await self._conn.commit()
+        self._conn.row_factory = aiosqlite.Row
+        await self._conn.create_function("epoch_ms", 1, to_epoch_ms, deterministic=True)
+
+        await self._conn._execute(self._import_legacy, self._conn._conn)
+        await self.readers.open()
+        self._tasks = [
+            asyncio.create_task(self.backfill_timestamps()),
+            asyncio.create_task(self.checkpointer.run())
+        ]
+
+    async def apply_profile(self, conn : aiosqlite.Connection) -> None:
+        for pragma, value in self.profile.items():
+            await conn.execute(f"PRAGMA {pragma}={value};")
+
+    def _import_legacy(self, conn : sqlite3.Connection) -> None:
+        """Copy the emails of the old inbox.db / outbox.db into this database, then set the files aside"""
+        for file_name, insert in LEGACY_IMPORTS.items():
+            legacy_path = os.path.join(self.dir_path, file_name)
+            if not os.path.exists(legacy_path):
+                continue
+
+            conn.execute("ATTACH DATABASE ? AS legacy", (legacy_path,))
+            try:
+                columns = {row[1] for row in conn.execute("PRAGMA legacy.table_info(emails)")}
+                if columns:
+                    with conn:
+                        imported = conn.execute(insert(columns)).rowcount
+                    self.logger.info(f"[Database] Imported {imported} row(s) from {file_name}")
+            finally:
+                conn.execute("DETACH DATABASE legacy")
+
+            # Keep the old file around, but make sure it is only imported once
+            for ext in ["-wal", "-shm"]:
+                try:
+                    os.remove(legacy_path + ext)
+                except FileNotFoundError:
+                    pass
+            os.replace(legacy_path, legacy_path + ".migrated")
+
+    async def backfill_timestamps(self, chunk_size=BACKFILL_CHUNK) -> int:
+        """
+        Fill in time_sent_ms / time_seen_ms of rows stored before those columns existed.
+        Runs online in small transactions, so the loops keep going while it catches up.
+        Rows whose strings do not parse fall back to time_seen, then to 0 (front of the queue).
+        """
+        statements = [
+            """
+            UPDATE inbox
+            SET time_sent_ms = COALESCE(epoch_ms(time_sent), epoch_ms(time_seen), 0),
+                time_seen_ms = COALESCE(time_seen_ms, epoch_ms(time_seen), 0)
+            WHERE rowid IN (SELECT rowid FROM inbox WHERE time_sent_ms IS NULL OR time_seen_ms IS NULL LIMIT ?)
+            """,
+            """
+            UPDATE outbox
+            SET time_sent_ms = COALESCE(epoch_ms(time_sent), 0)
+            WHERE rowid IN (SELECT rowid FROM outbox WHERE time_sent_ms IS NULL LIMIT ?)
+            """
+        ]
+        total = 0
+        for statement in statements:
+            while True:
+                updated = await self.run_in_transaction(lambda conn: conn.execute(statement, (chunk_size,)).rowcount)
+                if not updated:
+                    break
+                total += updated
+                # Let the other loops at the database between chunks
+                await asyncio.sleep(0)
+        if total:
+            self.logger.info(f"[Database] Backfilled timestamps of {total} row(s)")
+        return total
+
+    async def close(self, retries=5, delay=0.5) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.readers.close()
+
+        for _ in range(retries):
+            try:
+                await self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+                await self._conn.commit()
+                break
+            except aiosqlite.OperationalError as e:
+                if "locked" in str(e).lower():
+                    await asyncio.sleep(delay + random.random() * 0.2)
+            except Exception as e:
+                pass
+
+        await self._conn.close()
+
+        # Remove WAL and SHM files
+        for ext in ["-wal", "-shm"]:
+            try:
+                os.remove(self.path + ext)
+            except FileNotFoundError:
+                pass
+
+    # ----------------------------
+    # WAL checkpoints
+    # ----------------------------
+
+    def wal_size(self) -> int:
+        try:
+            return os.path.getsize(self.path + "-wal")
+        except FileNotFoundError:
+            return 0
+
+    async def checkpoint(self, mode : str = "PASSIVE") -> Optional[tuple]:
+        """Run a wal_checkpoint, returns its (busy, WAL frames, frames checkpointed) row or None if skipped"""
+        def run_checkpoint(conn : sqlite3.Connection):
+            # A checkpoint inside an open transaction cannot copy that transaction's pages
+            if conn.in_transaction:
+                return None
+            return tuple(conn.execute(f"PRAGMA wal_checkpoint({mode});").fetchone())
+
+        start = time.perf_counter()
+        try:
+            result = await self._conn._execute(run_checkpoint, self._conn._conn)
+        except sqlite3.Error:
+            self.logger.exception(f"[Database] {mode} checkpoint failed")
+            return None
+        if result is None:
+            return None
+
+        elapsed = time.perf_counter() - start
+        self.stats["checkpoints"] += 1
+        self.stats[mode.lower()] += 1
+        self.stats["busy"] += result[0]
+        self.stats["checkpoint_time"] += elapsed
+        self.stats["max_checkpoint_time"] = max(self.stats["max_checkpoint_time"], elapsed)
+        return result
+
+    def metrics(self) -> dict:
+        return {
+            "wal_bytes": self.wal_size(),
+            **self.stats,
+            "checkpoint_time": round(self.stats["checkpoint_time"], 4),
+            "max_checkpoint_time": round(self.stats["max_checkpoint_time"], 4),
+            "reads": self.readers.stats["reads"],
+            "read_waits": self.readers.stats["waits"]
+        }
+
+    # ----------------------------
+    # Operations
+    # ----------------------------
+
+    async def read(self, query : str, params : tuple | dict = (), retries=5, delay=0.5) -> list:
+        """Run a SELECT on the reader pool, returns all rows ([] on failure). Sees committed data only."""
+        self.last_activity = time.monotonic()
+        return await self.readers.read(query, params, retries, delay) or []
+
+    async def execute(self, query: str, params: tuple = (), retries=5, delay=0.5) -> Optional[aiosqlite.Cursor]:
+        """Run a statement on the writer connection"""
+        self.last_activity = time.monotonic()
+        if not query.lstrip().upper().startswith("SELECT"):
+            self.last_write = self.last_activity
+        return await retry_locked(lambda: self._conn.execute(query, params), self.logger, retries, delay)
+
+    async def commit(self) -> None:
+        self.last_activity = self.last_write = time.monotonic()
+        await self._conn.commit()
+
+    async def run_in_transaction(self, unit_of_work : Callable[[sqlite3.Connection], Any], retries=5, delay=0.5) -> Any:
+        """
+        Run unit_of_work(conn) as one call on aiosqlite's database thread, inside a single
+        transaction that is committed when it returns and rolled back when it raises.
+        A whole batch of statements costs one event loop <-> database thread hop, and a
+        locked database retries the whole unit. Returns its result, or None on failure.
+        """
+        def transaction(conn : sqlite3.Connection):
+            # IMMEDIATE takes the write lock up front, so a locked database fails
+            # before unit_of_work ran and retrying it is safe
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = unit_of_work(conn)
+                conn.commit()
+                return result
+            except BaseException:
+                conn.rollback()
+                raise
+
+        self.last_activity = self.last_write = time.monotonic()
+        # aiosqlite has no public API for running a function on its thread
+        return await retry_locked(lambda: self._conn._execute(transaction, self._conn._conn), self.logger, retries, delay)
+
+    async def execute_batch(self, statements : list, retries=5, delay=0.5) -> bool:
+        """Run a list of (query, params_seq) pairs through executemany as one unit of work"""
+        def unit_of_work(conn : sqlite3.Connection):
+            for query, params_seq in statements:
+                if params_seq:
+                    conn.executemany(query, params_seq)
+            return True
+
+        return bool(await self.run_in_transaction(unit_of_work, retries, delay))
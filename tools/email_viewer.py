@@ -5,13 +5,15 @@ import sqlite3
 class EmailViewer:
     def __init__(self):
         self.dir_path = os.path.join(os.getcwd(), "memory")
+        # inbox and outbox are tables of the one queue database, see tools/database.py
+        self.db_path = os.path.join(self.dir_path, "meep.db")
             
     def convert_to_csv(self, file_name : str):
-        db_path = os.path.join(self.dir_path, file_name + ".db")
+        db_path = self.db_path
         csv_path = os.path.join(self.dir_path, file_name + ".csv")
         with sqlite3.connect(db_path) as conn:
             c = conn.cursor()
-            c.execute("SELECT * FROM emails")
+            c.execute(f"SELECT * FROM {file_name}")
             rows = c.fetchall()
             col_names = [description[0] for description in c.description]
 
@@ -33,7 +35,7 @@ class EmailViewer:
                 pass
     
     def update_to_db(self, file_name : str):
-        db_path = os.path.join(self.dir_path, file_name + ".db")
+        db_path = self.db_path
         csv_path = os.path.join(self.dir_path, file_name + ".csv")
         with sqlite3.connect(db_path) as conn:
             c = conn.cursor()
@@ -49,7 +51,7 @@ class EmailViewer:
 
             # Build SQL update statement dynamically
             set_clause = ", ".join([f"{col} = ?" for col in col_names if col != "msg_id"])
-            update_sql = f"UPDATE emails SET {set_clause} WHERE {'msg_id'} = ?"
+            update_sql = f"UPDATE {file_name} SET {set_clause} WHERE {'msg_id'} = ?"
 
             # Find index of msg_id
             id_idx = col_names.index("msg_id")
@@ -1,8 +1,11 @@
 import re
+import asyncio
+import json
 import base64
 import os.path
 import logging
 import datetime
+import threading
 from email.message import EmailMessage
 from email.utils import parsedate_to_datetime
 from googleapiclient.discovery import build
@@ -14,6 +17,7 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 
 # my files
 from tools.logger import PrettyFormatter
+from tools.mime import extract_text
 
 # If modifying these scopes, delete the file gmail_token.json.
 SCOPES = [
@@ -22,29 +26,158 @@ SCOPES = [
 	"https://www.googleapis.com/auth/gmail.send"
 ]
 
+# Gmail API root, can be pointed at a local fake server through Gmail(api_endpoint=...)
+GMAIL_API_ENDPOINT = "https://gmail.googleapis.com/"
+
+# Incremental sync state (last seen historyId + ids not yet handed out), kept next to meep.db
+HISTORY_STATE_PATH = os.path.join(os.getcwd(), "memory", "gmail_history.json")
+
+# Only these headers are downloaded in the metadata pass, see fetch_emails
+METADATA_HEADERS = ["Subject", "From", "Message-ID", "Date"]
+
+# Default server-side filter applied when listing messages (history.list does not support q=),
+# e.g. "from:txt.voice.google.com -from:me" to only look at Google Voice texts
+GMAIL_QUERY = "-from:me"
+
+# Refresh the access token this long before it actually expires
+TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+'''
+HistoryState:
+- path: where the sync state is persisted
+- history_id: the gmail historyId we have synced up to
+- pending: ids of unread messages added since, that have not been handed out yet
+'''
+class HistoryState:
+	def __init__(self, logger, path : str = HISTORY_STATE_PATH):
+		self.logger = logger
+		self.path = path
+		self.history_id = None
+		self.pending = []
+		self.lock = threading.Lock()
+		self.load()
+
+	def load(self):
+		if os.path.exists(self.path):
+			try:
+				with open(self.path) as f:
+					state = json.load(f)
+				self.history_id = state.get("historyId")
+				self.pending = state.get("pending", [])
+			except Exception as e:
+				self.logger.error(f"[Gmail] Failed to parse gmail_history.json, doing a full resync: {e}")
+
+	def save(self):
+		tmp_path = self.path + ".tmp"
+		with open(tmp_path, "w") as f:
+			json.dump({"historyId": self.history_id, "pending": self.pending}, f)
+		os.replace(tmp_path, self.path)
+
+	def reset(self, history_id : str, pending : list):
+		self.logger.info(f"[Gmail] Full resync from historyId {history_id}, {len(pending)} unread message(s)")
+		self.history_id = history_id
+		self.pending = list(dict.fromkeys(pending))
+
+	def add_history_page(self, results : dict):
+		"""Queue the incoming unread messages of one history.list response page."""
+		for record in results.get('history', []):
+			for added_msg in record.get('messagesAdded', []):
+				message = added_msg['message']
+				# Our own replies show up as SENT, we only care about incoming unread mail
+				if "UNREAD" in message.get('labelIds', []) and message['id'] not in self.pending:
+					self.pending.append(message['id'])
+
+		# The last page carries the historyId of the mailbox at the time of the call
+		if not results.get('nextPageToken'):
+			self.history_id = results['historyId']
+
+	def take(self, chunk_size : int) -> list:
+		return self.pending[:chunk_size]
+
+	def done(self, chunk : list, failed : tuple = ()):
+		"""Drop a handed out chunk, the ids that failed to download go to the back of the queue to be retried"""
+		rest = [m for m in self.pending if m not in chunk]
+		self.pending = rest + [m for m in failed if m not in rest]
+
 '''
 Gmail:
 - logger: log info and errors log files
 - email: the email that's logged in
-- service: gmail service object
-- inboxes: the inboxes of the email (only the ones we care about)
-- email_queue: the emails that we have yet to process
+- service: gmail service object (cached per thread, see get_service)
+- service_stats: hit/miss/refresh counters of the service and credential cache
+- history: incremental sync state
+
+Credentials, parsing and reply building only, the gmail API itself is called by AsyncGmail.
 '''
 class Gmail:
-	def __init__(self, logger):
+	def __init__(self, logger, api_endpoint : str = GMAIL_API_ENDPOINT, credentials = None, query : str = GMAIL_QUERY):
 		log_path = os.path.join(os.getcwd(), "logs", "gmail_bot.log")
 
 		# Configure logger
 		self.logger = logger
 
+		# Configure API endpoints (overridable so we can run against a fake gmail server)
+		self._api_endpoint = api_endpoint
+
+		# Gmail search query used to filter messages server-side when listing
+		self.query = query or ""
+		# history.list does not take q=, its from: / -from: terms are applied to the metadata instead
+		self._sender_terms = [(negated == "-", term.lower()) for negated, term in re.findall(r'(?:^|\s)(-?)from:(\S+)', self.query)]
+
+		# Service and credential cache (injected credentials are used as is and never refreshed)
+		self._static_creds = credentials is not None
+		self._creds = credentials
+		self._token_json = None
+		self._creds_lock = threading.Lock()
+		self._local = threading.local()
+		self.service_stats = {"hits": 0, "misses": 0, "refreshes": 0}
+
+		# Incremental sync state, see AsyncGmail.sync_inbox
+		self.history = HistoryState(logger)
+
 		# Configure username (email) and valid inboxes
 		self.email = self.get_email()
 		self.logger.info("[Gmail] Registered user email: " + str(self.email))
 
-	def get_service(self):
+	def get_credentials(self):
 		"""
-		Set up and return credentials 
+		Return the cached credentials, loading them from disk (or logging in) on first use.
+		The token is refreshed in memory when it is close to expiry, and gmail_token.json is
+		only rewritten when the serialized token actually changes.
 		"""
+		with self._creds_lock:
+			if self._static_creds:
+				return self._creds
+			if self._creds is None:
+				self._creds = self._load_credentials()
+			elif self._needs_refresh(self._creds):
+				try:
+					self._creds.refresh(Request())
+					self.service_stats["refreshes"] += 1
+					self.logger.info("[Gmail] Refreshed expiring token.")
+					self._save_credentials(self._creds)
+				except Exception as e:
+					self._creds = None
+					self.logger.error(f"[Gmail] Failed to refresh gmail_token.json: {e}")
+			return self._creds
+
+	def cached_credentials(self):
+		"""Return the cached credentials if they can be used as is, without locking or refreshing."""
+		creds = self._creds
+		if creds is not None and (self._static_creds or not self._needs_refresh(creds)):
+			return creds
+		return None
+
+	def _needs_refresh(self, creds) -> bool:
+		if not creds.valid:
+			return True
+		if creds.expiry is None:
+			return False
+		# google-auth stores expiry as a naive UTC datetime
+		now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+		return creds.expiry - now < TOKEN_REFRESH_MARGIN
+
+	def _load_credentials(self):
 		creds = None
 		root_dir = os.path.join(os.getcwd(), "tools")
 		token_path = os.path.join(root_dir, "gmail_token.json")
@@ -54,21 +187,23 @@ class Gmail:
 		if os.path.exists(token_path):
 			try:
 				creds = Credentials.from_authorized_user_file(token_path, SCOPES)
+				self._token_json = creds.to_json()
 			except Exception as e:
 				creds = None
 				self.logger.error(f"[Gmail] Failed to parse gmail_token.json: {e}")
 
 		# If there are no (valid) credentials available
-		if not creds or not creds.valid:
-			if creds and creds.expired and creds.refresh_token:
-				# If the credentials is valid but expired, try to refresh the credentials.
+		if not creds or self._needs_refresh(creds):
+			if creds and creds.refresh_token:
+				# If the credentials is valid but (nearly) expired, try to refresh the credentials.
 				try:
 					creds.refresh(Request())
+					self.service_stats["refreshes"] += 1
 					self.logger.info("[Gmail] Refreshed expired token.")
 				except Exception as e:
 					creds = None
 					self.logger.error(f"[Gmail] Failed to refresh gmail_token.json: {e}")
-			else:
+			elif not creds or not creds.valid:
 				# We have to recreate creds, trigger manual login flow
 				flow = InstalledAppFlow.from_client_secrets_file(
 					credential_path, SCOPES
@@ -76,17 +211,52 @@ class Gmail:
 				creds = flow.run_local_server(port=0)
 				self.logger.info("[Gmail] Login successful.")
 
-			# Save and return our credentials
+			# Save our credentials
 			if creds:
-				with open(token_path, "w") as token:
-					token.write(creds.to_json())
-				self.logger.info("[Gmail] Saved new gmail_token.json")
-				
+				self._save_credentials(creds)
+		return creds
+
+	def _save_credentials(self, creds):
+		"""Write gmail_token.json, skipping the write if the token did not change."""
+		token_json = creds.to_json()
+		if token_json == self._token_json:
+			return
+		token_path = os.path.join(os.getcwd(), "tools", "gmail_token.json")
+		with open(token_path, "w") as token:
+			token.write(token_json)
+		self._token_json = token_json
+		self.logger.info("[Gmail] Saved new gmail_token.json")
+
+	def get_service(self):
+		"""
+		Set up and return the gmail service object.
+		The service is built once per thread (httplib2 connections are not thread-safe) and
+		reused until the credentials object is replaced. Refreshing the token in place does
+		not require a rebuild since the service holds a reference to the same credentials.
+		"""
+		creds = self.get_credentials()
 		if creds:
+			service = getattr(self._local, "service", None)
+			if service is not None and self._local.creds is creds:
+				with self._creds_lock:
+					self.service_stats["hits"] += 1
+				return service
+
 			try:
-				return build("gmail", "v1", credentials=creds) 
+				service = build(
+					"gmail", "v1",
+					credentials=creds,
+					cache_discovery=False,
+					client_options={"api_endpoint": self._api_endpoint}
+				)
 			except HttpError as error:
 				self.logger.error(f"[Gmail] An error occurred setting up service: {error}")
+			else:
+				self._local.service = service
+				self._local.creds = creds
+				with self._creds_lock:
+					self.service_stats["misses"] += 1
+				return service
 		self.logger.error(f"[Gmail] Gmail service object is NOT set up")
 		return None
 
@@ -124,128 +294,111 @@ class Gmail:
 		else:
 			self.logger.error("[Gmail] No service object")
 			
-	def reply_message(self, email):
-		service = self.get_service()
-		if service:
-			message = EmailMessage()
-			message.set_content(email["content"])
-			message["To"] = email["sender"]
-			message['Subject'] = "Re: " + email["subject"]
-			message['In-Reply-To'] = email["msg_id"]
-			message['References'] = email["msg_id"]
+	def build_reply(self, email) -> dict:
+		"""Build the messages.send request body replying to an email object"""
+		message = EmailMessage()
+		message.set_content(email["content"])
+		message["To"] = email["sender"]
+		message['Subject'] = "Re: " + email["subject"]
+		# Spooled Notion results are outbox rows of their own, replying to the message in reply_to
+		reply_to = email["reply_to"] if "reply_to" in email.keys() and email["reply_to"] else email["msg_id"]
+		message['In-Reply-To'] = reply_to
+		message['References'] = reply_to
 
-			# encoded message
-			encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+		# encoded message
+		encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+
+		return {"raw": encoded_message, "threadId": email["thread_id"]}
 
-			create_message = {"raw": encoded_message, "threadId": email["thread_id"]}
-			send_message = service.users().messages().send(userId="me", body=create_message).execute()
-			self.logger.info(f"[Gmail] Sent email: {email['content']}")
-		else:
-			self.logger.error("[Gmail] No service object")
-	
 	def parse_plaintext(self, payload):
-		content = ""
-		if 'parts' in payload:
-			# multipart message
-			for part in payload['parts']:
-				mime_type = part.get('mimeType')
-				# we only need the plaintext content
-				if mime_type == 'text/plain':
-					data = part.get('body', {}).get('data')
-					decoded_bytes = base64.urlsafe_b64decode(data.encode('UTF-8'))
-					body = decoded_bytes.decode('utf-8')
-					
-					status = 0
-					# We are using google voice so the content is sandwiched between elements linked to voice.google.com
-					for chunk in body.split("\n"):
-						if re.search("<https:\/\/voice\.google\.com.*>", chunk) or re.search("To respond to this text message, reply to this email or visit Google Voice.", chunk): # type: ignore
-							status += 1
-							if status >= 2:
-								break
-						else:
-							content += chunk.strip("\r") + "\n"
-			if content:
-				return content.strip("\n")
-			else:
-				self.logger.error("[Gmail] Missing content in message payload")
-		else:
-			self.logger.error("[Gmail] Missing parts in message payload")
-		return ""
+		content = extract_text(payload)
+		if not content:
+			self.logger.error("[Gmail] Missing content in message payload")
+		return content
 
-	def get_unread_emails(self, chunk_size) -> list:
-		emails = []
-		service = self.get_service()
-		if service:
-			results = service.users().messages().list(userId='me', labelIds=["UNREAD"], maxResults=chunk_size).execute()
-			messages = results.get('messages', [])
-
-			if messages:
-				self.logger.info(f"[Gmail] Got {len(messages)} new message(s)")
-				for msg in messages:
-					# For each unread email, get the relevant fields
-					gmail_msg_id = msg['id']
-					msg_data = service.users().messages().get(userId='me', id=gmail_msg_id, format='full').execute()
-					headers = msg_data['payload']['headers']
-					subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
-					sender = next((h['value'] for h in headers if h['name'] == 'From'), None)
-					msg_id = next((h['value'] for h in headers if h['name'] == 'Message-ID'), None)
-					time_sent = next((h['value'] for h in headers if h['name'] == 'Date'), None)
-					if time_sent:
-						time_sent = parsedate_to_datetime(time_sent).strftime("%Y-%m-%d %I:%M:%S %p")
-					time_seen = datetime.datetime.now().strftime("%Y-%m-%d %I:%M:%S %p")
-					thread_id = msg_data['threadId']
-					
-					if not (sender and msg_id): # If there is no sending or no message id
-						self.logger.error("[Gmail] Missing sender or Message-ID")
-					elif self.email and re.search(self.email, sender): # If this is a reply from MEEP
-						self.logger.warning("[Gmail] Sender is MEEP, skipping this email")
-						# TODO: maybe add a thing relabeling this email to ignored
-					else:
-						# Get content of email
-						content = self.parse_plaintext(msg_data['payload'])
-						
-						email_obj = {
-							"content": content,
-							"time_sent": time_sent,
-							"time_seen": time_seen,
-							"type": "unconfirmed",
-							"sender": sender,
-							"subject": subject,
-							"msg_id": msg_id,
-							"thread_id": thread_id,
-							"gmail_msg_id": gmail_msg_id
-						}
-						
-						emails.append(email_obj)
-						
-						try:
-							service.users().messages().modify(
-								userId="me",
-								id=gmail_msg_id,
-								body={
-									"removeLabelIds": ["UNREAD"]
-								}
-							).execute()
-						except:
-							self.logger.error(f"[Gmail] Failed to relabel email {content}")
-		else:
-			self.logger.error("[Gmail] Missing service or the specified inbox does not exist")
+	def parse_headers(self, msg_data):
+		"""
+		Turn a gmail message resource (format full or metadata) into an email object
+		for the inbox, without its content.
+		Returns None if the message should not be processed.
+		"""
+		headers = msg_data['payload']['headers']
+		subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject')
+		sender = next((h['value'] for h in headers if h['name'] == 'From'), None)
+		msg_id = next((h['value'] for h in headers if h['name'] == 'Message-ID'), None)
+		time_sent = next((h['value'] for h in headers if h['name'] == 'Date'), None)
+		# Epoch milliseconds sort chronologically and are what the queues order by,
+		# the strings are kept for display. internalDate is gmail's own receive time.
+		time_sent_ms = int(msg_data['internalDate']) if msg_data.get('internalDate') else None
+		if time_sent:
+			sent_at = parsedate_to_datetime(time_sent)
+			time_sent = sent_at.strftime("%Y-%m-%d %I:%M:%S %p")
+			if time_sent_ms is None:
+				time_sent_ms = int(sent_at.timestamp() * 1000)
+		seen_at = datetime.datetime.now()
+		time_seen = seen_at.strftime("%Y-%m-%d %I:%M:%S %p")
+		time_seen_ms = int(seen_at.timestamp() * 1000)
+		thread_id = msg_data['threadId']
 
-		return emails
+		if not (sender and msg_id): # If there is no sending or no message id
+			self.logger.error("[Gmail] Missing sender or Message-ID")
+			return None
+		if self.email and re.search(self.email, sender): # If this is a reply from MEEP
+			self.logger.warning("[Gmail] Sender is MEEP, skipping this email")
+			# TODO: maybe add a thing relabeling this email to ignored
+			return None
 
-	# check if there are any unread emails
-	def check_inbox(self) -> bool:
-		service = self.get_service()
-		# service obj exists
-		if service:
-			results = service.users().messages().list(userId='me', labelIds=["UNREAD"]).execute()
-			messages = results.get('messages', [])
-			if not messages:
-				return False
-			else:
-				return True
-		self.logger.error("[Gmail] Missing service")
-		return False
+		return {
+			"content": "",
+			"time_sent": time_sent,
+			"time_seen": time_seen,
+			"time_sent_ms": time_sent_ms if time_sent_ms is not None else time_seen_ms,
+			"time_seen_ms": time_seen_ms,
+			"type": "unconfirmed",
+			"sender": sender,
+			"subject": subject,
+			"msg_id": msg_id,
+			"thread_id": thread_id,
+			"gmail_msg_id": msg_data['id']
+		}
+
+	def parse_message(self, msg_data):
+		"""Same as parse_headers, but also fills in the content of a format=full message"""
+		email_obj = self.parse_headers(msg_data)
+		if email_obj:
+			email_obj["content"] = self.parse_plaintext(msg_data['payload'])
+		return email_obj
+
+	def matches_sender(self, sender : str) -> bool:
+		"""
+		Check a From header against the from: / -from: terms of query (any from: term has to
+		match, no -from: term may). "me" stands for the logged in email.
+		"""
+		sender = sender.lower()
+
+		def matches(term):
+			return (self.email or "").lower() in sender if term == "me" else term in sender
+
+		includes = [term for negated, term in self._sender_terms if not negated]
+		if includes and not any(matches(term) for term in includes):
+			return False
+		return not any(matches(term) for negated, term in self._sender_terms if negated)
+
+	def select_emails(self, metadata : list) -> dict:
+		"""
+		First pass of the two-phase fetch: pick the messages worth downloading from their
+		metadata. Returns the email objects (without content) keyed by gmail message id.
+		"""
+		selected = {}
+		for msg_data in metadata:
+			# Could have been read somewhere else since it was listed
+			if "UNREAD" not in msg_data.get('labelIds', []):
+				continue
+			email_obj = self.parse_headers(msg_data)
+			# The incremental sync lists every new message, whatever the query says
+			if email_obj and self.matches_sender(email_obj["sender"]):
+				selected[msg_data['id']] = email_obj
+		return selected
 
 if __name__ == "__main__":
 	# Configure logger
@@ -263,5 +416,10 @@ if __name__ == "__main__":
 	handler.setFormatter(formatter)
 	logger.addHandler(handler)
 
-	obj = Gmail(logger)
-	obj.get_unread_emails(5)
\ No newline at end of file
+	async def main():
+		from tools.gmail_async import AsyncGmail
+		gmail_client = await AsyncGmail.create(logger)
+		print(await gmail_client.get_unread_emails(5))
+		await gmail_client.terminate()
+
+	asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import aiohttp
+from typing import Awaitable, Callable, Optional
+
+# my files
+from tools.gmail import Gmail, GMAIL_API_ENDPOINT, GMAIL_QUERY, METADATA_HEADERS
+from tools.ratelimit import TokenBucket
+from tools.seen import SeenStore
+
+# Gmail per-user rate limit, and the cost of each method we use (in quota units)
+QUOTA_UNITS_PER_SECOND = 250
+QUOTA_UNITS = {
+	"getProfile": 1,
+	"history.list": 2,
+	"messages.list": 5,
+	"messages.get": 5,
+	"messages.modify": 5,
+	"messages.batchModify": 50,
+	"messages.send": 100
+}
+
+class GmailException(Exception):
+	def __init__(self, *args: object, status : int = 0) -> None:
+		super().__init__(*args)
+		self.status = status
+
+	def __str__(self) -> str:
+		return f"[!] Gmail Exception: {self.args[0]}"
+
+'''
+AsyncGmail:
+- logger: log info and errors log files
+- email: the email that's logged in
+- gmail: the synchronous Gmail object, used for credentials, parsing and the sync state
+- quota: token bucket accounting for the gmail per-user quota units of every request
+- seen: optional SeenStore, messages it knows are never downloaded again
+- _client: pooled keep-alive aiohttp session talking to the gmail REST API
+'''
+class AsyncGmail:
+	def __init__(self, gmail : Gmail, logger : logging.Logger, max_connections : int = 10) -> None:
+		self.logger = logger
+		self.gmail = gmail
+		self.email = gmail.email
+		self._max_connections = max_connections
+		self.quota = TokenBucket(QUOTA_UNITS_PER_SECOND, QUOTA_UNITS_PER_SECOND)
+		self.seen : Optional[SeenStore] = None
+		self._client : aiohttp.ClientSession
+
+	@classmethod
+	async def create(cls, logger : logging.Logger, api_endpoint : str = GMAIL_API_ENDPOINT, credentials = None, query : str = GMAIL_QUERY, max_connections : int = 10) -> 'AsyncGmail':
+		'''Asynchronous instantiation of an AsyncGmail object'''
+		# Gmail() does blocking IO (token file, login flow, profile lookup)
+		loop = asyncio.get_running_loop()
+		gmail = await loop.run_in_executor(None, lambda: Gmail(logger, api_endpoint, credentials, query))
+
+		gmail_obj = cls(gmail, logger, max_connections)
+		gmail_obj._client = aiohttp.ClientSession(
+			base_url=api_endpoint.rstrip("/") + "/gmail/v1/users/me/",
+			connector=aiohttp.TCPConnector(limit=max_connections, keepalive_timeout=60, ttl_dns_cache=300),
+			timeout=aiohttp.ClientTimeout(total=30)
+		)
+		return gmail_obj
+
+	async def terminate(self):
+		await self._client.close()
+
+	@property
+	def service_stats(self) -> dict:
+		return self.gmail.service_stats
+
+	# ----------------------------
+	# Transport
+	# ----------------------------
+
+	async def _headers(self) -> dict:
+		# Only leave the event loop when the token actually has to be (re)loaded or refreshed
+		creds = self.gmail.cached_credentials()
+		if creds is None:
+			creds = await asyncio.get_running_loop().run_in_executor(None, self.gmail.get_credentials)
+		if creds is None:
+			raise GmailException("Missing gmail credentials")
+
+		headers = {}
+		creds.apply(headers)
+		return headers
+
+	async def request(self, method : str, url : str, params : dict | list | None = None, data : dict | None = None, units : int = 1) -> dict:
+		'''
+		Send a request costing units quota units to the gmail API.
+		Returns the decoded JSON body, raises GmailException on errors.
+		'''
+		await self.quota.acquire(units)
+		async with self._client.request(method, url, params=params, json=data, headers=await self._headers()) as resp:
+			if resp.status == 204:
+				return {}
+			try:
+				body = await resp.json(content_type=None)
+			except ValueError:
+				# e.g. the HTML error page of a google frontend 502
+				raise GmailException(f"{method} {url} returned {resp.status}: {resp.reason} (not JSON)", status=resp.status)
+			if resp.status == 429:
+				self.quota.drain()
+			if resp.status >= 400:
+				message = (body or {}).get("error", {}).get("message", resp.reason)
+				raise GmailException(f"{method} {url} returned {resp.status}: {message}", status=resp.status)
+			return body or {}
+
+	# ----------------------------
+	# API
+	# ----------------------------
+
+	async def get_messages(self, gmail_msg_ids : list, format : str = "full", metadata_headers : list | None = None, missed : list | None = None) -> list:
+		'''
+		Fetch messages concurrently over the pooled connections, skipping the ones that failed.
+		Ids that failed for a reason other than the message being gone (404) are added to missed.
+		'''
+		semaphore = asyncio.Semaphore(self._max_connections)
+		params = [("format", format)] + [("metadataHeaders", header) for header in metadata_headers or []]
+
+		async def get(gmail_msg_id):
+			async with semaphore:
+				try:
+					return await self.request("GET", f"messages/{gmail_msg_id}", params=params, units=QUOTA_UNITS["messages.get"])
+				except (GmailException, aiohttp.ClientError, asyncio.TimeoutError) as e:
+					self.logger.error(f"[Gmail] Failed to fetch message {gmail_msg_id}: {e}")
+					if missed is not None and getattr(e, "status", 0) != 404:
+						missed.append(gmail_msg_id)
+					return None
+
+		results = await asyncio.gather(*(get(gmail_msg_id) for gmail_msg_id in gmail_msg_ids))
+		return [msg_data for msg_data in results if msg_data]
+
+	async def mark_as_read(self, gmail_msg_ids : list) -> list:
+		'''Remove UNREAD with one batchModify, falling back to per-message modify calls. Returns the failed ids.'''
+		if not gmail_msg_ids:
+			return []
+		try:
+			await self.request(
+				"POST", "messages/batchModify",
+				data={"ids": gmail_msg_ids, "removeLabelIds": ["UNREAD"]},
+				units=QUOTA_UNITS["messages.batchModify"]
+			)
+			return []
+		except (GmailException, aiohttp.ClientError, asyncio.TimeoutError) as e:
+			self.logger.warning(f"[Gmail] batchModify failed, relabeling individually: {e}")
+
+		failed = []
+		for gmail_msg_id in gmail_msg_ids:
+			try:
+				await self.request(
+					"POST", f"messages/{gmail_msg_id}/modify",
+					data={"removeLabelIds": ["UNREAD"]},
+					units=QUOTA_UNITS["messages.modify"]
+				)
+			except (GmailException, aiohttp.ClientError, asyncio.TimeoutError):
+				self.logger.error(f"[Gmail] Failed to relabel email {gmail_msg_id}")
+				failed.append(gmail_msg_id)
+		return failed
+
+	async def fetch_emails(self, gmail_msg_ids : list, missed : list | None = None) -> list:
+		'''
+		Two-phase fetch: the metadata (METADATA_HEADERS only) of every message, then the full
+		payload of the ones select_emails picked. Messages already ingested are skipped before
+		anything is downloaded. Nothing is marked as read here, that waits until the emails were
+		committed to the inbox (see sync_inbox). Ids that could not be downloaded (and are worth
+		retrying) are added to missed.
+		'''
+		if self.seen:
+			gmail_msg_ids = await self.seen.filter_unseen(gmail_msg_ids)
+			if not gmail_msg_ids:
+				return []
+		metadata = await self.get_messages(gmail_msg_ids, format="metadata", metadata_headers=METADATA_HEADERS, missed=missed)
+		selected = self.gmail.select_emails(metadata)
+
+		emails = []
+		for msg_data in await self.get_messages(list(selected), missed=missed):
+			email_obj = selected[msg_data['id']]
+			email_obj["content"] = self.gmail.parse_plaintext(msg_data['payload'])
+			emails.append(email_obj)
+		return emails
+
+	async def check_inbox(self) -> bool:
+		results = await self.request("GET", "messages", params={"labelIds": "UNREAD", "q": self.gmail.query, "maxResults": 1}, units=QUOTA_UNITS["messages.list"])
+		return bool(results.get('messages'))
+
+	async def get_unread_emails(self, chunk_size) -> list:
+		results = await self.request("GET", "messages", params={"labelIds": "UNREAD", "q": self.gmail.query, "maxResults": chunk_size}, units=QUOTA_UNITS["messages.list"])
+		messages = results.get('messages', [])
+		if not messages:
+			return []
+
+		self.logger.info(f"[Gmail] Got {len(messages)} new message(s)")
+		return await self.fetch_emails([msg['id'] for msg in messages])
+
+	async def _full_resync(self):
+		'''Reset the sync state: remember the current historyId and queue every unread message'''
+		# Grab the historyId first so nothing that arrives while listing is missed
+		history_id = (await self.request("GET", "profile", units=QUOTA_UNITS["getProfile"]))['historyId']
+
+		pending = []
+		params = {"labelIds": "UNREAD", "q": self.gmail.query, "maxResults": 500}
+		while True:
+			results = await self.request("GET", "messages", params=params, units=QUOTA_UNITS["messages.list"])
+			pending.extend(msg['id'] for msg in results.get('messages', []))
+			if not results.get('nextPageToken'):
+				break
+			params["pageToken"] = results['nextPageToken']
+
+		self.gmail.history.reset(history_id, pending)
+
+	async def _sync_history(self) -> bool:
+		'''Queue the unread messages added since the stored historyId, False if it expired'''
+		history = self.gmail.history
+		params = {"startHistoryId": history.history_id, "historyTypes": "messageAdded"}
+		while True:
+			try:
+				results = await self.request("GET", "history", params=params, units=QUOTA_UNITS["history.list"])
+			except GmailException as e:
+				if e.status == 404:
+					self.logger.warning(f"[Gmail] historyId {history.history_id} expired")
+					return False
+				raise
+
+			history.add_history_page(results)
+			if not results.get('nextPageToken'):
+				return True
+			params["pageToken"] = results['nextPageToken']
+
+	async def sync_inbox(self, chunk_size, ingest : Callable[[list], Awaitable[bool]]) -> list:
+		'''
+		Incremental sync: an idle poll costs a single history.list call. New unread messages are
+		queued in the sync state (gmail.history) and handed out chunk_size at a time.
+		The downloaded emails are passed to ingest, which commits them and returns whether it
+		did. Only then does the chunk leave the queue and lose its UNREAD label, so a failed
+		commit fetches the same messages again on the next poll.
+		'''
+		history = self.gmail.history
+		before = (history.history_id, len(history.pending))
+		if not history.history_id or not await self._sync_history():
+			await self._full_resync()
+
+		emails = []
+		chunk = history.take(chunk_size)
+		if chunk:
+			self.logger.info(f"[Gmail] Got {len(chunk)} new message(s)")
+			missed = []
+			emails = await self.fetch_emails(chunk, missed)
+			if not emails or await ingest(emails):
+				# historyId already moved past them, so failed downloads stay queued
+				history.done(chunk, missed)
+			else:
+				self.logger.error(f"[Gmail] Failed to ingest {len(emails)} email(s), keeping them queued")
+				emails = []
+
+		# Small JSON file, not worth a thread hop
+		if (history.history_id, len(history.pending)) != before:
+			history.save()
+
+		if emails:
+			# Committed as seen with UNREAD still on, the relabel loop retries what fails here
+			gmail_msg_ids = [email_obj["gmail_msg_id"] for email_obj in emails]
+			failed = await self.mark_as_read(gmail_msg_ids)
+			if self.seen:
+				await self.seen.relabeled([i for i in gmail_msg_ids if i not in failed], failed)
+		return emails
+
+	async def reply_message(self, email):
+		await self.request("POST", "messages/send", data=self.gmail.build_reply(email), units=QUOTA_UNITS["messages.send"])
+		self.logger.info(f"[Gmail] Sent email: {email['content']}")
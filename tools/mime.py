@@ -0,0 +1,154 @@
+import re
+import sys
+import html
+import json
+import base64
+import timeit
+
+# Never decode more than this many bytes of a body, texts are tiny
+MAX_BODY_BYTES = 64 * 1024
+
+# Google Voice sandwiches the text between lines linking back to voice.google.com
+VOICE_MARKER = re.compile(r"<https://voice\.google\.com[^\n]*>|To respond to this text message, reply to this email or visit Google Voice\.")
+
+HTML_BREAK = re.compile(r"<br\s*/?>|</p>|</div>|</tr>", re.IGNORECASE)
+HTML_DROP = re.compile(r"<(script|style|head)\b.*?</\1>", re.IGNORECASE | re.DOTALL)
+HTML_TAG = re.compile(r"<[^>]+>")
+CHARSET = re.compile(r"charset=\"?([\w-]+)", re.IGNORECASE)
+
+def find_part(payload : dict, mime_type : str) -> dict | None:
+	'''Depth-first search (in document order) of a gmail payload for the first part of mime_type with data'''
+	stack = [payload]
+	while stack:
+		part = stack.pop()
+		if part.get('mimeType') == mime_type and part.get('body', {}).get('data'):
+			return part
+		# reversed so the first child is visited first
+		stack.extend(reversed(part.get('parts', [])))
+	return None
+
+def decode_body(part : dict, max_bytes : int = MAX_BODY_BYTES) -> str:
+	'''Decode the base64url body of a part, only looking at the first max_bytes bytes'''
+	data = part['body']['data']
+
+	# every 4 base64 characters hold 3 bytes
+	data = data[:(max_bytes // 3 + 1) * 4]
+	data += "=" * (-len(data) % 4)
+	raw = base64.urlsafe_b64decode(data)[:max_bytes]
+
+	charset = "utf-8"
+	for header in part.get('headers', []):
+		if header['name'].lower() == 'content-type':
+			match = CHARSET.search(header['value'])
+			if match:
+				charset = match.group(1)
+	try:
+		# a truncated body can end mid-character
+		return raw.decode(charset, errors="ignore")
+	except LookupError:
+		return raw.decode("utf-8", errors="ignore")
+
+def html_to_text(body : str) -> str:
+	body = HTML_DROP.sub("", body)
+	body = HTML_BREAK.sub("\n", body)
+	return html.unescape(HTML_TAG.sub("", body))
+
+def strip_voice_wrapper(body : str) -> str:
+	'''
+	Drop the Google Voice marker lines and everything after the second one.
+	Only the kept slices are copied, in a single pass over the precompiled markers.
+	'''
+	kept = []
+	start = 0
+	markers = 0
+	for match in VOICE_MARKER.finditer(body):
+		# several markers can share a line, a line only counts once
+		if match.start() < start:
+			continue
+		line_start = body.rfind("\n", 0, match.start()) + 1
+		line_end = body.find("\n", match.end())
+		kept.append(body[start:line_start])
+		start = len(body) if line_end == -1 else line_end + 1
+		markers += 1
+		if markers >= 2:
+			break
+	else:
+		kept.append(body[start:])
+
+	return "".join(kept).replace("\r", "").strip("\n")
+
+def extract_text(payload : dict, max_bytes : int = MAX_BODY_BYTES) -> str:
+	'''
+	Return the text of a gmail message payload: the first text/plain part anywhere in the
+	MIME tree, falling back to the first text/html part, without the Google Voice wrapper.
+	'''
+	part = find_part(payload, 'text/plain')
+	if part:
+		return strip_voice_wrapper(decode_body(part, max_bytes))
+
+	part = find_part(payload, 'text/html')
+	if part:
+		return strip_voice_wrapper(html_to_text(decode_body(part, max_bytes)))
+	return ""
+
+# ----------------------------
+# Microbenchmark
+# ----------------------------
+
+def _legacy_extract_text(payload):
+	'''The previous Gmail.parse_plaintext, kept for comparison'''
+	content = ""
+	if 'parts' in payload:
+		for part in payload['parts']:
+			if part.get('mimeType') == 'text/plain':
+				data = part.get('body', {}).get('data')
+				body = base64.urlsafe_b64decode(data.encode('UTF-8')).decode('utf-8')
+				status = 0
+				for chunk in body.split("\n"):
+					if re.search(r"<https:\/\/voice\.google\.com.*>", chunk) or re.search("To respond to this text message, reply to this email or visit Google Voice.", chunk): # type: ignore
+						status += 1
+						if status >= 2:
+							break
+					else:
+						content += chunk.strip("\r") + "\n"
+	return content.strip("\n")
+
+def _sample_payloads() -> list:
+	'''Payloads shaped like the Google Voice emails MEEP receives'''
+	def encode(text):
+		return base64.urlsafe_b64encode(text.encode()).decode()
+
+	def voice_body(text):
+		return (
+			"<https://voice.google.com>\r\n" + text + "\r\n"
+			"YOUR ACCOUNT <https://voice.google.com> HELP CENTER <https://support.google.com/voice#topic=1707989> HELP FORUM <https://productforums.google.com/forum/#!forum/voice>\r\n"
+			"To respond to this text message, reply to this email or visit Google Voice.\r\n"
+			"You are receiving this email because you previously asked to receive emails when you get new messages.\r\n"
+		)
+
+	short = voice_body("!notion\r\nFinances\r\nadd\r\nMatcha\r\n8.23")
+	long = voice_body("\r\n".join(f"line {i} of a long pasted message" for i in range(1000)))
+	payloads = []
+	for text in [short, long]:
+		html_body = {"mimeType": "text/html", "body": {"data": encode("<p>" + text + "</p>")}}
+		plain = {"mimeType": "text/plain", "body": {"data": encode(text)}}
+		# flat multipart/alternative, the layout the old parser understood
+		payloads.append({"mimeType": "multipart/alternative", "parts": [plain, html_body]})
+		# the same thing nested in multipart/mixed, which the old parser skipped
+		payloads.append({"mimeType": "multipart/mixed", "parts": [{"mimeType": "multipart/alternative", "parts": [plain, html_body]}]})
+	return payloads
+
+if __name__ == "__main__":
+	# python -m tools.mime [payloads.json], where payloads.json holds a list of recorded gmail payloads
+	if len(sys.argv) > 1:
+		with open(sys.argv[1]) as f:
+			payloads = json.load(f)
+	else:
+		payloads = _sample_payloads()
+
+	runs = 200
+	legacy = timeit.timeit(lambda: [_legacy_extract_text(p) for p in payloads], number=runs)
+	current = timeit.timeit(lambda: [extract_text(p) for p in payloads], number=runs)
+	print(f"{len(payloads)} payloads x {runs} runs")
+	print(f"legacy parse_plaintext: {legacy / runs * 1000:8.3f} ms per pass")
+	print(f"extract_text:           {current / runs * 1000:8.3f} ms per pass ({legacy / current:.1f}x)")
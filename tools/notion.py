@@ -2,13 +2,16 @@ import os
 import re
 import sys
 import json
+import time
 import asyncio
 import aiohttp
 import dateparser
 from datetime import datetime, timezone
-from typing import Any
+import logging
+from typing import Any, Callable, Optional
 from types import SimpleNamespace
 from fuzzywuzzy import process
+from tools.ratelimit import TokenBucket, backoff_delay, RETRY_STATUSES, NOT_SENT_ERRORS
 
 class NotionException(Exception):
     def __init__(self, *args: object) -> None:
@@ -17,54 +20,162 @@ class NotionException(Exception):
     def __str__(self) -> str:
         return f"[!] Notion Exception: {self.args[0]}"
 
+class NotionUnavailableException(NotionException):
+    '''Notion could not be reached, or kept failing with 429/5xx: the request is worth trying again later'''
+
+class NotionUnknownOutcomeException(NotionUnavailableException):
+    '''A write timed out or failed with a 5xx, Notion may or may not have applied it'''
+
 def exception_handler(exception_type, exception, traceback):
     # All your trace are belong to us!
     print(exception)
 
 
+NOTION_API_ENDPOINT = "https://api.notion.com/v1/"
+NOTION_VERSION = "2025-09-03"
+# Seconds a single request may take, connect included
+REQUEST_TIMEOUT = 15
+MAX_CONNECTIONS = 10
+
+# Notion allows about 3 requests per second per integration
+REQUESTS_PER_SECOND = 3
+MAX_IN_FLIGHT = 3
+MAX_RETRIES = 5
+
+# Parsed datasource schemas, so a restart can serve commands before Notion answered
+SCHEMA_CACHE_PATH = os.path.join(os.getcwd(), "memory", "notion_schema.json")
+SCHEMA_CACHE_TTL = 24 * 60 * 60
+# A schema fetched this recently is trusted, validation errors do not refresh it again
+SCHEMA_REFRESH_COOLDOWN = 30
+
+'''
+NotionClient: the one Notion API client, shared by every datasource
+- rate: token bucket keeping every request under the Notion rate limit
+- stats: requests, retries, 429s, writes with an unknown outcome, and the time requests spent queued for a slot
+- _client: keep-alive aiohttp session, so all datasources share one connection pool,
+  one set of TLS sessions and one DNS cache
+- _in_flight: caps the number of concurrent requests
+'''
 class NotionClient:
-    def __init__(self, api_key : str) -> None:
+    def __init__(self, api_key : str, api_endpoint : str = NOTION_API_ENDPOINT, max_connections : int = MAX_CONNECTIONS, max_in_flight : int = MAX_IN_FLIGHT, max_retries : int = MAX_RETRIES) -> None:
+        self.rate = TokenBucket(REQUESTS_PER_SECOND, REQUESTS_PER_SECOND)
+        self.max_retries = max_retries
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "failed": 0, "unknown_outcome": 0, "queue_wait": 0.0}
+        self._in_flight = asyncio.Semaphore(max_in_flight)
         self._client = aiohttp.ClientSession(
-            base_url="https://api.notion.com/v1/",
+            base_url=api_endpoint,
             headers={
                 "Authorization": f"Bearer {api_key}", # type: ignore
-                "Notion-Version": "2025-09-03",
+                "Notion-Version": NOTION_VERSION,
                 "Content-Type": "application/json"
-            }
+            },
+            connector=aiohttp.TCPConnector(limit=max_connections, keepalive_timeout=60, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
         )
 
         # datasource endpoints
         self.datasources = SimpleNamespace(
-            get = lambda id: self.get(f"data_sources/{id}")
+            get = lambda id: self.get(f"data_sources/{id}"),
+            # Read only, safe to resend
+            query = lambda id, query: self.post(f"data_sources/{id}/query", query, idempotent=True)
         )
 
         self.pages = SimpleNamespace(
             create = lambda page: self.post(f"pages", page)
         )
 
-    async def get(self, url : str):
-        resp = await self._client.get(url)
-        return json.loads(await resp.text())
+    async def request(self, method : str, url : str, data = None, timeout : float = REQUEST_TIMEOUT, idempotent : Optional[bool] = None) -> dict:
+        '''
+        Send a request within the rate limit and concurrency cap. 429s wait for Retry-After,
+        5xx and connection errors are retried with jittered backoff. Never raises: failures
+        come back as a Notion style error object ({"object": "error", "message": ...}).
+        Requests that are not idempotent (POST unless told otherwise) are only resent after a
+        429 or a failed connect: a timeout or 5xx may have been applied already, so it comes
+        back as an error with code "unknown_outcome" instead.
+        '''
+        if idempotent is None:
+            idempotent = method == "GET"
+        self.stats["requests"] += 1
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            async with self._in_flight:
+                await self.rate.acquire()
+                self.stats["queue_wait"] += time.monotonic() - start
+                try:
+                    async with self._client.request(method, url, json=data, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                        status = resp.status
+                        retry_after = resp.headers.get("Retry-After")
+                        try:
+                            # Notion error bodies are JSON too, whatever the status or content type
+                            body = await resp.json(content_type=None)
+                        except ValueError:
+                            body = {"object": "error", "status": status, "message": f"Notion returned HTTP {status}"}
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    status, retry_after, body = 0, None, {"object": "error", "status": 0, "message": f"Notion request failed: {type(e).__name__} {e}".rstrip()}
+                    sent = not isinstance(e, NOT_SENT_ERRORS)
+                else:
+                    sent = True
+
+            if status and status not in RETRY_STATUSES:
+                return body
+            if not idempotent and sent and status != 429:
+                self.stats["unknown_outcome"] += 1
+                return {"object": "error", "status": status, "code": "unknown_outcome", "message": f"{body.get('message')} (may have been applied, not retried)"}
+            if attempt == self.max_retries:
+                break
+
+            self.stats["retries"] += 1
+            if status == 429:
+                self.stats["rate_limited"] += 1
+                # Everyone backs off, not just this request
+                self.rate.drain()
+                try:
+                    delay = float(retry_after) # type: ignore
+                except (TypeError, ValueError):
+                    delay = backoff_delay(attempt, base=1)
+            else:
+                delay = backoff_delay(attempt)
+            await asyncio.sleep(delay)
+
+        self.stats["failed"] += 1
+        return body
+
+    async def get(self, url : str, timeout : float = REQUEST_TIMEOUT):
+        return await self.request("GET", url, timeout=timeout)
     
-    async def post(self, url : str, data = None):
-        resp = await self._client.post(url, json=data)
-        return json.loads(await resp.text())
+    async def post(self, url : str, data = None, timeout : float = REQUEST_TIMEOUT, idempotent : bool = False):
+        return await self.request("POST", url, data, timeout, idempotent)
+
+    def metrics(self) -> dict:
+        return {
+            **self.stats,
+            "queue_wait": round(self.stats["queue_wait"], 3),
+            "throttled": self.rate.stats["throttled"]
+        }
 
     async def close(self):
         await self._client.close()
 
 class Datasource:
-    def __init__(self, name : str, configs: dict, api_key : str) -> None:
+    def __init__(self, name : str, configs: dict, client : NotionClient) -> None:
 
         # Important fields
         self.name = name
         self.description = ""
         self._id = ""
-        self._api_key = api_key
         self._properties = {}
-
-        # Create Async Notion API client
-        self._client = NotionClient(api_key)
+        # When the schema was fetched, and whether it came from the schema cache
+        self.fetched_at = 0.0
+        self.from_cache = False
+        # Called after a refresh changed the schema (Notion saves its schema cache)
+        self.on_refresh : Optional[Callable[[], None]] = None
+        self._refresh : Optional[asyncio.Task] = None
+        self._config = configs
+        # Optional rich_text property pages carry their idempotency key in, see find_page
+        self._key_property : Optional[str] = configs.get("idempotency_property")
+
+        # Shared Async Notion API client, owned by Notion
+        self._client = client
 
         # Initializes
         #   lookup: maps inputs to corresponding properties
@@ -84,55 +195,128 @@ class Datasource:
                 if "optional" in props:
                     for _, opt_prop_name in props["optional"].items():
                         self._properties[opt_prop_name] = {}
+            if self._key_property:
+                self._properties[self._key_property] = {}
         except:
             raise NotionException(f"Invalid commands configuration for datasource: [{name}]")
 
     @classmethod
-    async def create(cls, name : str, config: dict, api_key : str) -> 'Datasource':
-        datasource_obj = cls(name, config, api_key)
-        
-        # Get datasource information
-        resp = await datasource_obj._client.datasources.get(datasource_obj._id)
+    async def create(cls, name : str, config: dict, client : NotionClient, cached : Optional[dict] = None) -> 'Datasource':
+        '''Set up a datasource from its cached schema if that is still usable, otherwise from Notion'''
+        datasource_obj = cls(name, config, client)
+        if not (cached and datasource_obj.load_cache(cached)):
+            await datasource_obj.fetch_schema()
+        return datasource_obj
+
+    async def fetch_schema(self) -> None:
+        '''Get the description and configured properties of this datasource from Notion'''
+        resp = await self._client.datasources.get(self._id)
+        if resp.get("object") == "error":
+            raise NotionException(f"Failed to load datasource [{self.name}]: {resp.get('message')}")
 
         # Get datasource description
+        description = ""
         for chunk in resp["description"]:
             if chunk["type"] == "text":
-                datasource_obj.description += chunk["plain_text"] + " "
+                description += chunk["plain_text"] + " "
 
         # Get datasource properties
+        properties = {prop_name: {} for prop_name in self._properties}
         for prop_name, prop_value in resp["properties"].items():
-            if prop_name in datasource_obj._properties:
+            if prop_name in properties:
                 # set up current property according to the type
                 curr_property = {
                     "id": prop_value["id"],
                     "type": prop_value["type"]
                 }
                 match prop_value["type"]:
-                    case "title" | "number" | "date":
+                    case "title" | "rich_text" | "number" | "date":
                         pass
                     case "select":
                         curr_property["options"] = {}
                         for option in prop_value["select"]["options"]:
                             curr_property["options"][option["name"]] = option["id"]
                     case _:
-                        raise NotionException(f"[{datasource_obj.name}]'s property type {prop_value['type']} is unsupported.")
+                        raise NotionException(f"[{self.name}]'s property type {prop_value['type']} is unsupported.")
                 
-                datasource_obj._properties[prop_name] = curr_property
+                properties[prop_name] = curr_property
 
         # Checks all properties in config are valid
-        for prop_name, prop_value in datasource_obj._properties.items():
+        for prop_name, prop_value in properties.items():
             if not prop_value:
-                raise NotionException(f"Datasource [{datasource_obj.name}]'s property [{prop_name}] is not found.")
-        
-        return datasource_obj
+                raise NotionException(f"Datasource [{self.name}]'s property [{prop_name}] is not found.")
+
+        # Swapped in at once, commands running meanwhile see either the old or the new schema
+        self.description, self._properties = description, properties
+        self.fetched_at = time.time()
+
+    async def refresh_schema(self, stale_since : float) -> bool:
+        '''
+        Refetch the schema after a request failed against the one fetched at stale_since.
+        Single flight: concurrent callers share one fetch. Returns True if there is a newer
+        schema to retry with.
+        '''
+        if self.fetched_at > stale_since:
+            return True
+        if self._refresh is None or self._refresh.done():
+            if time.time() - self.fetched_at < SCHEMA_REFRESH_COOLDOWN:
+                return False
+            self._refresh = asyncio.create_task(self.fetch_schema())
+        try:
+            # Shielded, so a cancelled caller does not cancel the fetch for the others
+            await asyncio.shield(self._refresh)
+        except Exception:
+            return False
+        if self.on_refresh:
+            self.on_refresh()
+        return True
+
+    def load_cache(self, cached : dict) -> bool:
+        '''Use a cached schema, False if it is expired or does not match the configuration'''
+        if cached.get("id") != self._id or set(cached.get("properties", {})) != set(self._properties):
+            return False
+        if time.time() - cached.get("fetched_at", 0) > SCHEMA_CACHE_TTL:
+            return False
+        self.description = cached["description"]
+        self._properties = cached["properties"]
+        self.fetched_at = cached["fetched_at"]
+        self.from_cache = True
+        return True
+
+    def to_cache(self) -> dict:
+        return {"id": self._id, "description": self.description, "properties": self._properties, "fetched_at": self.fetched_at}
         
     # async def get_page(self, )
     
     # async def edit_page(self, page_id, properties : dict):
     #     for prop, value in properties:
 
+    async def add_page(self, arguments : dict, retry : bool = True, idempotency_key : Optional[str] = None) -> str:
+        '''
+        Add a page, refreshing the schema and retrying once if it looks outdated.
+        idempotency_key is written to the idempotency_property (if configured), see find_page.
+        '''
+        schema_time = self.fetched_at
+        message, schema_error = await self._add_page(arguments, idempotency_key)
+        if schema_error and retry and await self.refresh_schema(schema_time):
+            return await self.add_page(arguments, retry=False, idempotency_key=idempotency_key)
+        return message
+
+    async def find_page(self, idempotency_key : str) -> Optional[bool]:
+        '''Whether a page carrying idempotency_key exists, None if no idempotency_property is configured'''
+        if not self._key_property:
+            return None
+        response = await self._client.datasources.query(self._id, {
+            "filter": {"property": self._key_property, "rich_text": {"equals": idempotency_key}},
+            "page_size": 1
+        })
+        if response.get("object") == "error":
+            raise NotionUnavailableException(f"Failed to look up [{idempotency_key}] in [{self.name}]: {response.get('message')}")
+        return bool(response.get("results"))
+
     # assumes arguments are valid (property names and values are correct)
-    async def add_page(self, arguments : dict) -> str:
+    async def _add_page(self, arguments : dict, idempotency_key : Optional[str] = None) -> tuple[str, bool]:
+        '''Returns the result message, and whether the error could come from an outdated schema'''
         # Create page object
         page = {}
         page["parent"] = {
@@ -149,7 +333,8 @@ class Datasource:
 
             code, payload = self.format_property(arg, value)
             if not code:
-                return payload
+                # Unknown select options may just have been added in Notion
+                return payload, prop_type in ("select", "multi_select")
 
             page["properties"][arg] = {
                 "id": prop_id,
@@ -157,14 +342,24 @@ class Datasource:
                 prop_type: payload, 
             }
         
+        if idempotency_key and self._key_property:
+            page["properties"][self._key_property] = {
+                "rich_text": [{"type": "text", "text": {"content": idempotency_key}}]
+            }
+
         response = await self._client.pages.create(page)
         if not response: # creation failed
             print(response)
-            return "Error: Creating page encountered unexpected error."
+            return "Error: Creating page encountered unexpected error.", False
         if response["object"] == "error":
-            return "Error: " + response["message"]
+            if response.get("code") == "unknown_outcome":
+                raise NotionUnknownOutcomeException(response["message"])
+            if response.get("status") == 0 or response.get("status") in RETRY_STATUSES:
+                raise NotionUnavailableException(response["message"])
+            # e.g. a renamed property or a changed type
+            return "Error: " + response["message"], response.get("code") == "validation_error"
 
-        return "Success"
+        return "Success", False
 
     def format_property(self, prop_name, prop_value) -> tuple[int, Any]:
         '''Returns formatted property, returns error message if property value is invalid'''
@@ -231,17 +426,15 @@ class Datasource:
             case "select":
                 matched_option = process.extractOne(prop_value, self._properties[prop_name]["options"].keys())
                 if not matched_option or matched_option[1] < 80:
-                    print("Invalid option", prop_value)
-                    return 0, {}
+                    return 0, f"Error: [{prop_value}] is an invalid option for [{prop_name}]."
                 return 1, {"name": matched_option[0]}
             
             case "multi_select":
                 prop = []
                 for value in prop_value:
                     matched_option = process.extractOne(value, self._properties[prop_name]["options"])
-                    if matched_option[1] < 80: # type: ignore
-                        print("Invalid option", value)
-                        return 0, {}
+                    if not matched_option or matched_option[1] < 80:
+                        return 0, f"Error: [{value}] is an invalid option for [{prop_name}]."
                     prop.append({ "name": matched_option[0] }) # type: ignore
                 return 1, prop
             
@@ -261,9 +454,6 @@ class Datasource:
 
         return return_str
     
-    async def terminate(self):
-        await self._client.close()
-    
     def __str__(self) -> str:
         return json.dumps({"name": self.name, "id": self._id, "properties": self._properties}, indent=4)
 
@@ -272,17 +462,31 @@ class Datasource:
     
 
 class Notion:
-    def __init__(self) -> None:
+    def __init__(self, logger : Optional[logging.Logger] = None) -> None:
         '''Set up Notion object according to configuration file'''
 
         # Important fields
+        self.logger : logging.Logger = logger or logging.getLogger("Notion")
+        self._revalidate : Optional[asyncio.Task] = None
         self._api_key = ""
         self._blocks = {}
         self._datasources = {}
+        self._client : NotionClient
         self.command_config = {"blocks": {}, "datasources": {}}
 
         # Retrieve configurations as defined in the json file
-        config_file_path = os.path.join(os.getcwd(), "tools", "notion_config.json")
+        self._config_path = os.path.join(os.getcwd(), "tools", "notion_config.json")
+        self._config_mtime = 0.0
+        self._reload_lock = asyncio.Lock()
+        mtime = os.path.getmtime(self._config_path) if os.path.exists(self._config_path) else 0.0
+        self._api_key, self._blocks, self._datasources, self.command_config = self.read_config()
+        self._config_mtime = mtime
+
+    def read_config(self) -> tuple[str, dict, dict, dict]:
+        '''Parse notion_config.json, returns (api key, block configs, datasource configs, command config)'''
+        config_file_path = self._config_path
+        blocks, datasources = {}, {}
+        command_config = {"blocks": {}, "datasources": {}}
         
         # 
         if not os.path.exists(config_file_path):
@@ -298,7 +502,7 @@ class Notion:
             if "NOTION_KEY" not in config.keys():
                 raise NotionException("Notion API key not found")
 
-            self._api_key = config["NOTION_KEY"]
+            api_key = config["NOTION_KEY"]
 
             # set up block and datasource configurations
             for k, v in config.items():
@@ -311,28 +515,137 @@ class Notion:
                     # checks: type = block or datasource
                     match v["type"]:
                         case "block":
-                            self._blocks[k] = v
-                            self.command_config["blocks"][k] = v["commands"]
+                            blocks[k] = v
+                            command_config["blocks"][k] = v["commands"]
                         case "datasource":
-                            self._datasources[k] = v
-                            self.command_config["datasources"][k] = v["commands"]
+                            datasources[k] = v
+                            command_config["datasources"][k] = v["commands"]
                         case _:
                             raise NotionException(f"Invalid type of endpoint: [{k}]")
 
+        return api_key, blocks, datasources, command_config
+
+    async def reload_config(self) -> bool:
+        '''
+        Pick up changes to notion_config.json without a restart. Only datasources whose
+        configuration changed are set up again, the others keep their schema. A broken
+        config (or Notion being down while setting it up) is logged and the reload tried
+        again on the next call. Setting datasources up again can take a while, so this is
+        only called from the spool (see NotionSpool.run). Returns True if a new configuration
+        is in use.
+        '''
+        try:
+            if os.path.getmtime(self._config_path) == self._config_mtime:
+                return False
+        except OSError:
+            return False
+
+        async with self._reload_lock:
+            # Taken before reading, so an edit made while reloading is picked up next time
+            mtime = os.path.getmtime(self._config_path)
+            if mtime == self._config_mtime:
+                return False # reloaded while we waited for the lock
+
+            client = None
+            try:
+                api_key, blocks, configs, command_config = self.read_config()
+                # A new key means a new client, and every datasource has to be set up with it
+                client = self._client if api_key == self._api_key else NotionClient(api_key)
+                reused = {
+                    name: self._datasources[name] for name, config in configs.items()
+                    if client is self._client and name in self._datasources and self._datasources[name]._config == config
+                }
+                created = await asyncio.gather(*(
+                    Datasource.create(name, config, client) for name, config in configs.items() if name not in reused
+                ))
+            except NotionException as e:
+                self.logger.error(f"[Notion] Keeping the previous configuration, reloading failed: {e}")
+                if client and client is not self._client:
+                    await client.close()
+                return False
+
+            datasources = {**reused, **{datasource.name: datasource for datasource in created}}
+            for datasource in created:
+                datasource.on_refresh = self.save_schema_cache
+            old_client = self._client
+            self._api_key, self._blocks, self.command_config, self._client = api_key, blocks, command_config, client
+            self._datasources = {name: datasources[name] for name in configs}
+            # Only recorded once the new configuration is in use, a failed reload is retried
+            self._config_mtime = mtime
+            if old_client is not client:
+                await old_client.close()
+            self.save_schema_cache()
+            self.logger.info(f"[Notion] Reloaded configuration, set up {len(created)} datasource(s) again")
+            return True
+
     @classmethod
-    async def create(cls) -> 'Notion':
+    async def create(cls, logger : Optional[logging.Logger] = None) -> 'Notion':
         '''Asynchronous instantiation of a Notion object'''
-        notion_obj = cls()
-
-        # set up datasource objects for each datasource
-        for datasource_name, config in notion_obj._datasources.items():
-            notion_obj._datasources[datasource_name] = await Datasource.create(datasource_name, config, notion_obj._api_key)
+        notion_obj = cls(logger)
+        notion_obj._client = NotionClient(notion_obj._api_key)
+
+        # set up datasource objects for each datasource, all at once.
+        # Cached schemas are used right away and refreshed in the background.
+        cache = notion_obj.load_schema_cache()
+        names = list(notion_obj._datasources)
+        datasources = await asyncio.gather(*(
+            Datasource.create(name, notion_obj._datasources[name], notion_obj._client, cache.get(name)) for name in names
+        ))
+        notion_obj._datasources = dict(zip(names, datasources))
+        for datasource in datasources:
+            datasource.on_refresh = notion_obj.save_schema_cache
+
+        if any(datasource.from_cache for datasource in datasources):
+            notion_obj._revalidate = asyncio.create_task(notion_obj.revalidate_schemas())
+        else:
+            notion_obj.save_schema_cache()
         
         return notion_obj
+
+    # ----------------------------
+    # Schema cache
+    # ----------------------------
+
+    def load_schema_cache(self) -> dict:
+        try:
+            with open(SCHEMA_CACHE_PATH) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_schema_cache(self) -> None:
+        # Small JSON file, not worth a thread hop. Written to a temp file first so it is never half written.
+        try:
+            tmp_path = SCHEMA_CACHE_PATH + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({name: datasource.to_cache() for name, datasource in self._datasources.items()}, f)
+            os.replace(tmp_path, SCHEMA_CACHE_PATH)
+        except OSError as e:
+            self.logger.warning(f"[Notion] Failed to save the schema cache: {e}")
+
+    async def revalidate_schemas(self) -> None:
+        '''Refetch the schemas that came from the cache, keeping the cached ones if Notion fails'''
+        cached = [datasource for datasource in self._datasources.values() if datasource.from_cache]
+        results = await asyncio.gather(*(datasource.fetch_schema() for datasource in cached), return_exceptions=True)
+        for datasource, result in zip(cached, results):
+            if isinstance(result, Exception):
+                self.logger.warning(f"[Notion] Revalidating [{datasource.name}] failed, keeping the cached schema: {result}")
+            else:
+                datasource.from_cache = False
+        self.save_schema_cache()
+        self.logger.info(f"[Notion] Revalidated {sum(not datasource.from_cache for datasource in cached)} of {len(cached)} cached schema(s)")
     
+    def metrics(self) -> dict:
+        return self._client.metrics()
+
     async def terminate(self):
-        for _, datasource in self._datasources.items():
-            await datasource.terminate()
+        if self._revalidate and not self._revalidate.done():
+            self._revalidate.cancel()
+            try:
+                await self._revalidate
+            except asyncio.CancelledError:
+                pass
+        await self._client.close()
 
     def help(self, command_type : str) -> str:
         '''
@@ -503,7 +816,34 @@ class Notion:
             
         return (1, {"type": endpoint_type, "endpoint": endpoint, "action": action, "arguments": command_arguments})
     
-    async def run_command(self, command : str) -> str:
+    def check_command(self, command : str) -> str:
+        '''
+        Error reply for a command run_command would reject without calling Notion, "" if it is valid.
+        Parsed against the configuration already loaded, config edits are picked up by the spool.
+        '''
+        status, payload = self.parse_command(command)
+        return "" if status else f"Error: {payload}"
+
+    def can_find_command(self, command : str) -> bool:
+        '''Whether find_command can tell if this command was applied (its datasource has an idempotency_property)'''
+        status, payload = self.parse_command(command)
+        return bool(status) and payload["type"] == "datasources" and bool(self._datasources[payload["endpoint"]]._key_property)
+
+    async def find_command(self, command : str, idempotency_key : str) -> Optional[bool]:
+        '''Whether the write of a command run with idempotency_key is in Notion, None if that cannot be told'''
+        status, payload = self.parse_command(command)
+        if not status or payload["type"] != "datasources":
+            return None
+        return await self._datasources[payload["endpoint"]].find_page(idempotency_key)
+
+    async def run_command(self, command : str, idempotency_key : Optional[str] = None) -> str:
+        '''
+        Run a command, raises NotionUnavailableException if Notion could not be reached
+        (NotionUnknownOutcomeException if the write may have been applied anyway).
+        '''
+        # One stat per command, notion_config.json edits apply to the next command
+        # (only ever called from the spool workers, a reload may set datasources up again)
+        await self.reload_config()
         status, payload = self.parse_command(command)
 
         # Command failed to be parsed
@@ -516,7 +856,7 @@ class Notion:
             # Route to corresponding actions
             match payload["action"]:
                 case "add":
-                    return "Command: " + command.replace("\n", " ") + "\n" + await endpoint.add_page(payload["arguments"])
+                    return "Command: " + command.replace("\n", " ") + "\n" + await endpoint.add_page(payload["arguments"], idempotency_key=idempotency_key)
 
         return f"{command} did not match any Notion command."
 
@@ -525,7 +865,7 @@ class Notion:
         return bool(self._api_key) and (bool(self._blocks) or bool(self._datasources))
 
 async def main():
-    obj = await Notion.create()
+    obj = await Notion.create(logging.getLogger("Notion"))
     if not obj:
         return
     
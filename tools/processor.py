@@ -1,12 +1,18 @@
 import os
 import time
-import random
+import sqlite3
 import asyncio
 import logging
 import aiosqlite
 from fuzzywuzzy import process
-from typing import Literal, Optional
+from typing import Optional
+from tools.database import Database, DatabaseException, fair_select, SENT_ORDER
 from tools.notion import Notion
+from tools.ratelimit import TokenBucket
+from tools.scheduler import PollScheduler, wait_for_event
+from tools.sessions import SessionStore
+from tools.seen import SeenStore
+from tools.spool import NotionSpool
 
 class ProcessorException(Exception):
     def __init__(self, *args: object) -> None:
@@ -19,147 +25,217 @@ def exception_handler(exception_type, exception, traceback):
     # All your trace are belong to us!
     print(exception)
 
+# Loops wake up on events, polling the database this often is only a safety net
+SAFETY_NET_POLL = 30
+
+# Backlog (unconfirmed + command rows) at which fetching pauses, and at which it resumes.
+# Rows deferred by the per sender rate limit do not count, one flooding sender must not pause everyone.
+INBOX_HIGH_WATERMARK = 200
+INBOX_LOW_WATERMARK = 50
+
+# Per sender flood protection: messages classified per minute and burst, excess rows are deferred
+SENDER_RATE_PER_MINUTE = 20
+SENDER_BURST = 10
+MAX_SENDER_BUCKETS = 1000
+
 class Processor:
     def __init__(self, logger : logging.Logger) -> None:
-        self.chat_started : bool = False
+        # Set whenever new rows are written, so the downstream loop wakes up right away.
+        # SQLite stays the source of truth, the events only cut the polling latency.
+        self.inbox_ready : asyncio.Event = asyncio.Event()
+        self.outbox_ready : asyncio.Event = asyncio.Event()
+        # Set while the inbox backlog is at or below the low watermark, see wait_for_capacity
+        self.inbox_has_room : asyncio.Event = asyncio.Event()
+        self.inbox_has_room.set()
+        self.high_watermark = INBOX_HIGH_WATERMARK
+        self.low_watermark = INBOX_LOW_WATERMARK
+        self.queue_stats = {"depth": 0, "ready": 0, "max_depth": 0, "throttled": 0, "throttled_time": 0.0, "deferred": 0}
+        self.sender_rate = SENDER_RATE_PER_MINUTE
+        self.sender_burst = SENDER_BURST
+        self._sender_buckets : dict[str, TokenBucket] = {}
+        # Chat mode is per sender, replaces the old process wide chat_started flag
+        self.sessions = SessionStore(logger)
+        self.seen : SeenStore
+        self.scheduler = PollScheduler("Processor Loop", logger, floor=0.5, ceiling=SAFETY_NET_POLL, wake_event=self.inbox_ready)
         self._notion : Notion
+        self.spool : NotionSpool
         self.logger : logging.Logger = logger
     
     @classmethod
-    async def create(cls, logger : logging.Logger) -> 'Processor':
+    async def create(cls, logger : logging.Logger, db_profile : Optional[dict] = None) -> 'Processor':
         processor_obj = cls(logger)
         
-        ok = await processor_obj.init_db()
+        ok = await processor_obj.init_db(db_profile)
         if not ok:
             raise ProcessorException(f"Initializing DB setup failed.")
         
-        processor_obj._notion = await Notion.create()
+        processor_obj._notion = await Notion.create(logger)
+        # Notion writes are spooled, so a slow or down Notion never holds up the inbox
+        processor_obj.spool = NotionSpool(processor_obj._db, processor_obj._notion, logger, reply_ready=processor_obj.outbox_ready)
 
         return processor_obj
 
-    async def init_db(self, retries=5, delay=0.5) -> bool:
-        """Initialize async DB connection and enable WAL mode with retry."""
-        for _ in range(retries):
-            try:
-                self._inbox = await aiosqlite.connect(os.path.join(os.getcwd(), "memory", "inbox.db"), timeout=10)
-                await self._inbox.execute("PRAGMA journal_mode=WAL;")
-                await self._inbox.execute("PRAGMA synchronous=NORMAL;")
-                await self._inbox.execute("""
-                    CREATE TABLE IF NOT EXISTS emails (
-                        content TEXT,
-                        time_sent TEXT,
-                        time_seen TEXT,
-                        type TEXT,
-                        sender TEXT,
-                        subject TEXT,
-                        msg_id TEXT PRIMARY KEY,
-                        thread_id TEXT,
-                        gmail_msg_id TEXT
-                    )
-                """)
-                await self._inbox.commit()
-                self._inbox.row_factory = aiosqlite.Row
-        
-                self._outbox = await aiosqlite.connect(os.path.join(os.getcwd(), "memory", "outbox.db"), timeout=10)
-                await self._outbox.execute("PRAGMA journal_mode=WAL;")
-                await self._outbox.execute("PRAGMA synchronous=NORMAL;")
-                await self._outbox.execute("""
-                    CREATE TABLE IF NOT EXISTS emails (
-                        content TEXT,
-                        time_sent TEXT,
-                        sender TEXT,
-                        subject TEXT,
-                        msg_id TEXT PRIMARY KEY,
-                        thread_id TEXT,
-                        gmail_msg_id TEXT
-                    )
-                """)
-                await self._outbox.commit()
-                self._outbox.row_factory = aiosqlite.Row
-
-                return True
-            except aiosqlite.OperationalError as e:
-                if "locked" in str(e).lower():
-                    await asyncio.sleep(delay)
-            except Exception as e:
-                raise ProcessorException(e)
-        return False
+    async def init_db(self, profile : Optional[dict] = None, retries=5, delay=0.5) -> bool:
+        """
+        Open the queue database (inbox + outbox), importing the old inbox.db / outbox.db once.
+        profile overrides PRAGMAs of tools.database.PERFORMANCE_PROFILE.
+        """
+        try:
+            self._db = await Database.create(self.logger, profile=profile, retries=retries, delay=delay)
+            self.seen = SeenStore(self._db, self.logger)
+            return True
+        except DatabaseException as e:
+            raise ProcessorException(e)
     
-    async def terminate(self, retries=5, delay=0.5):
-        for _ in range(retries):
-            try:
-                await self._inbox.execute("PRAGMA wal_checkpoint(TRUNCATE);") 
-                await self._inbox.commit()
+    @property
+    def notion_stats(self) -> dict:
+        return self._notion.metrics()
 
-                await self._outbox.execute("PRAGMA wal_checkpoint(TRUNCATE);")
-                await self._outbox.commit()
-                break
-            except aiosqlite.OperationalError as e:
-                if "locked" in str(e).lower():
-                    await asyncio.sleep(delay + random.random() * 0.2)
-            except Exception as e:
-                pass
-            
-        await self._inbox.close()
-        await self._outbox.close()
-
-        # Remove WAL and SHM files
-        for db_name in ["inbox", "outbox"]:
-            db_path = os.path.join(os.getcwd(), "memory", f"{db_name}.db")
-            for ext in ["-wal", "-shm"]:
-                try:
-                    os.remove(db_path + ext)
-                except FileNotFoundError:
-                    pass
+    @property
+    def spool_stats(self) -> dict:
+        return self.spool.metrics()
 
-        await self._notion.terminate()
+    @property
+    def session_stats(self) -> dict:
+        return self.sessions.metrics()
 
-    # ----------------------------
-    # Database Operations wrapper
-    # ----------------------------
+    @property
+    def db_stats(self) -> dict:
+        """WAL size and checkpoint counts / durations of the queue database"""
+        return self._db.metrics()
+
+    async def terminate(self, retries=5, delay=0.5):
+        await self._db.close(retries, delay)
+        await self._notion.terminate()
 
-    async def execute(self, db_name : Literal["inbox", "outbox"], query: str, params: tuple = (), retries=5, delay=0.5) -> Optional[aiosqlite.Cursor]:
-        for _ in range(retries):
-            try:
-                db = self._inbox if db_name == "inbox" else self._outbox
-                return await db.execute(query, params)
-            except aiosqlite.OperationalError as e:
-                if "locked" in str(e).lower():
-                    await asyncio.sleep(delay)
-            except Exception:
-                self.logger.exception(f"[Processor] ")
-                pass
-        return None
-    
     # ----------------------------
     # Application Logic
     # ----------------------------
 
-    async def get_outgoing_emails(self, chunk_size):
-        cursor = await self.execute("outbox", "SELECT * FROM emails LIMIT ?", (chunk_size,))
-        if not cursor:
-            return []
-        return await cursor.fetchall()
-
-    async def remove_from_outbox(self, emails):
-        for email_obj in emails:
-            await self.execute(
-                "outbox", 
-                "DELETE FROM emails WHERE msg_id = ?", 
-                (email_obj["msg_id"],)
+    async def claim_outgoing_emails(self, worker_id : str, chunk_size : int, lease_seconds : float = 120) -> list:
+        """
+        Atomically lease up to chunk_size pending outbox rows to worker_id.
+        Rows whose lease expired (the worker crashed mid-send) can be claimed again.
+        A row replying to another outbox row (see NotionSpool.finish) waits until that one went
+        out, so the two are never sent at once and arrive in order.
+        Every claimed row must be acked or released by the same worker.
+        """
+        now = int(time.time() * 1000)
+        emails = await self._db.run_in_transaction(lambda conn: conn.execute(
+            """
+            UPDATE outbox
+            SET status = 'sending', lease_owner = ?, lease_expires = ?, attempts = attempts + 1
+            WHERE msg_id IN (
+                SELECT msg_id FROM outbox AS reply
+                WHERE (status = 'pending' OR (status = 'sending' AND lease_expires < ?))
+                AND NOT EXISTS (SELECT 1 FROM outbox WHERE msg_id = reply.reply_to AND status != 'failed')
+                ORDER BY time_sent_ms
+                LIMIT ?
             )
-            self.logger.info(f"[Processor] Deleted \"{email_obj['content']}\" from outbox")
-        await self._outbox.commit()
-
-    async def add_emails_to_inbox(self, emails):
-        for email_obj in emails:
-            await self.execute(
-                "inbox", 
-                """
-                INSERT OR REPLACE INTO emails
-                (content, time_sent, time_seen, type, sender, subject, msg_id, thread_id, gmail_msg_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, 
+            RETURNING *
+            """,
+            (worker_id, now + int(lease_seconds * 1000), now, chunk_size)
+        ).fetchall())
+        return emails or []
+
+    async def ack_outgoing_email(self, email_obj, worker_id : str) -> bool:
+        """Delete a sent row, as long as worker_id still holds its lease"""
+        deleted = await self._db.run_in_transaction(lambda conn: conn.execute(
+            "DELETE FROM outbox WHERE msg_id = ? AND lease_owner = ?",
+            (email_obj["msg_id"], worker_id)
+        ).rowcount)
+        if not deleted:
+            self.logger.warning(f"[Processor] Lost the lease on \"{email_obj['content']}\" before acking it")
+            return False
+        self.logger.info(f"[Processor] Deleted \"{email_obj['content']}\" from outbox")
+        return True
+
+    async def extend_outgoing_lease(self, email_obj, worker_id : str, lease_seconds : float = 120) -> bool:
+        """Push back the lease expiry of a claimed row before a retry, False if worker_id no longer holds it"""
+        extended = await self._db.run_in_transaction(lambda conn: conn.execute(
+            "UPDATE outbox SET lease_expires = ? WHERE msg_id = ? AND lease_owner = ?",
+            (int((time.time() + lease_seconds) * 1000), email_obj["msg_id"], worker_id)
+        ).rowcount)
+        return bool(extended)
+
+    async def release_outgoing_email(self, email_obj, worker_id : str, failed : bool = False) -> None:
+        """Give a claimed row back, either to be retried (pending) or parked for good (failed)"""
+        await self._db.execute_batch([(
+            "UPDATE outbox SET status = ?, lease_owner = NULL, lease_expires = NULL WHERE msg_id = ? AND lease_owner = ?",
+            [("failed" if failed else "pending", email_obj["msg_id"], worker_id)]
+        )])
+
+    async def get_emails_between(self, start_ms : int, end_ms : int, table : str = "inbox") -> list:
+        """Rows of the inbox or outbox sent in [start_ms, end_ms), oldest first"""
+        if table not in ("inbox", "outbox"):
+            raise ProcessorException(f"Unknown table {table}")
+        return await self._db.read(
+            f"SELECT * FROM {table} WHERE time_sent_ms >= ? AND time_sent_ms < ? ORDER BY time_sent_ms",
+            (start_ms, end_ms)
+        )
+
+    async def inbox_depth(self) -> tuple[int, int]:
+        """Number of inbox rows still waiting to be classified or run, and how many of those are not deferred"""
+        rows = await self._db.read(
+            """
+            SELECT COUNT(*) as cnt, COUNT(CASE WHEN deferred_until > ? THEN 1 END) as deferred
+            FROM inbox WHERE state IN ('unconfirmed', 'Command')
+            """,
+            (int(time.time() * 1000),)
+        )
+        depth, deferred = (rows[0]["cnt"], rows[0]["deferred"]) if rows else (0, 0)
+        self.queue_stats["depth"] = depth
+        self.queue_stats["ready"] = depth - deferred
+        self.queue_stats["max_depth"] = max(self.queue_stats["max_depth"], depth)
+        if depth - deferred <= self.low_watermark:
+            self.inbox_has_room.set()
+        return depth, depth - deferred
+
+    async def sender_depths(self, limit : int = 10) -> dict:
+        """Queued (and deferred) inbox rows of the senders with the deepest backlog"""
+        rows = await self._db.read(
+            """
+            SELECT sender, COUNT(*) as cnt, COUNT(CASE WHEN deferred_until > ? THEN 1 END) as deferred
+            FROM inbox WHERE state IN ('unconfirmed', 'Command')
+            GROUP BY sender ORDER BY cnt DESC LIMIT ?
+            """,
+            (int(time.time() * 1000), limit)
+        )
+        return {row["sender"]: {"queued": row["cnt"], "deferred": row["deferred"]} for row in rows}
+
+    async def wait_for_capacity(self, stop_event : asyncio.Event) -> None:
+        """
+        Backpressure for the fetch loop: returns right away below the high watermark,
+        otherwise waits until the processor drained the backlog down to the low watermark.
+        Only rows that are not deferred count, deferred rows wait on their sender's rate
+        limit rather than on the processor. Unfetched mail simply stays unread in gmail meanwhile.
+        """
+        if (await self.inbox_depth())[1] < self.high_watermark:
+            return
+
+        self.inbox_has_room.clear()
+        self.queue_stats["throttled"] += 1
+        self.logger.warning(f"[Processor] Inbox backlog reached {self.queue_stats['ready']}, pausing fetch until it drops to {self.low_watermark}")
+        start = time.monotonic()
+        while not stop_event.is_set():
+            # Woken up by the processor loop, re-counting now and then is a safety net
+            await wait_for_event(self.inbox_has_room, SAFETY_NET_POLL)
+            if (await self.inbox_depth())[1] <= self.low_watermark:
+                break
+            self.inbox_has_room.clear()
+        self.queue_stats["throttled_time"] += time.monotonic() - start
+        self.logger.info(f"[Processor] Inbox backlog down to {self.queue_stats['ready']}, resuming fetch")
+
+    async def add_emails_to_inbox(self, emails) -> bool:
+        """Queue fetched emails for classification, False if the insert failed"""
+        # Marked seen in the same transaction, so a queued message is never fetched again
+        ok = await self._db.execute_batch([self.seen.record(emails), (
+            """
+            INSERT OR REPLACE INTO inbox
+            (content, time_sent, time_seen, state, sender, subject, msg_id, thread_id, gmail_msg_id, time_sent_ms, time_seen_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
                 (
                     email_obj["content"],
                     email_obj["time_sent"],
@@ -169,20 +245,31 @@ class Processor:
                     email_obj["subject"],
                     email_obj["msg_id"],
                     email_obj["thread_id"],
-                    email_obj["gmail_msg_id"]
+                    email_obj["gmail_msg_id"],
+                    email_obj["time_sent_ms"],
+                    email_obj["time_seen_ms"]
                 )
-            )
-        await self._inbox.commit()
+                for email_obj in emails
+            ]
+        )])
+        if ok:
+            self.seen.remember(emails)
+            if emails:
+                self.inbox_ready.set()
+        return ok
     
-    async def reply_emails(self, emails):
-        for message, email_obj in emails:
-            await self.execute(
-                "outbox", 
-                """
-                INSERT OR REPLACE INTO emails
-                (content, time_sent, sender, subject, msg_id, thread_id, gmail_msg_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, 
+    async def reply_emails(self, emails, spooled = ()):
+        """Queue (message, email) replies and drop the handled inbox rows, spooling the (command, email) Notion writes"""
+        if not emails:
+            return
+        # Queue the replies, spool the writes and drop the handled inbox rows in one transaction
+        ok = await self._db.execute_batch([self.spool.enqueue(spooled), (
+            """
+            INSERT OR REPLACE INTO outbox
+            (content, time_sent, sender, subject, msg_id, thread_id, gmail_msg_id, time_sent_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
                 (
                     message,
                     email_obj["time_sent"],
@@ -190,70 +277,137 @@ class Processor:
                     email_obj["subject"],
                     email_obj["msg_id"],
                     email_obj["thread_id"],
-                    email_obj["gmail_msg_id"]
+                    email_obj["gmail_msg_id"],
+                    email_obj["time_sent_ms"]
                 )
-            )
-            await self.execute(
-                "inbox", 
-                "DELETE FROM emails WHERE msg_id = ?", 
-                (email_obj["msg_id"],)
-            )
-        await self._inbox.commit()
-        await self._outbox.commit()
-
-    async def classify_emails(self, chunk_size) -> None:
-        cursor = await self.execute("inbox", "SELECT * FROM emails WHERE type = 'unconfirmed' LIMIT ?", (chunk_size,))
-        if not cursor:
-            return
-
-        emails = await cursor.fetchall()
+                for message, email_obj in emails
+            ]
+        ), (
+            "DELETE FROM inbox WHERE msg_id = ?", [(email_obj["msg_id"],) for _, email_obj in emails]
+        )])
+        if ok:
+            self.spool.queued(spooled)
+        self.outbox_ready.set()
 
+    def _classify(self, emails, conn : sqlite3.Connection) -> tuple[list, list]:
+        """
+        Decide what happens to each unconfirmed email, returns (relabels, deletes) parameters.
+        Runs on the database thread, conn is used for the chat sessions of the senders.
+        """
+        # Label changes are collected and written in one transaction by the caller
+        relabels = []
+        deletes = []
         for email in emails:
             message = email["content"]
             
             if len(message) <= 1:
-                await self.execute("inbox", "DELETE FROM emails WHERE msg_id = ?", (email["msg_id"],))
+                deletes.append((email["msg_id"],))
                 continue
             first_line = message.split("\n")[0]
             
-            # Chatbot mode
+            # Chatbot mode, per sender
+            session = self.sessions.get(conn, email["sender"])
             chat_commands = ['hey meep', 'bye meep']
             matched_command = process.extractOne(first_line, chat_commands)
             if matched_command and matched_command[1] >= 80:
-                if not self.chat_started and matched_command[0] == 'hey meep':
-                    self.chat_started = True
-                    await self.execute("inbox", "UPDATE emails SET type = ? WHERE msg_id = ?", ("Chat", email["msg_id"]))
-                    self.logger.info(f"[Processor] Chat mode started")
+                if not session and matched_command[0] == 'hey meep':
+                    self.sessions.start(conn, email["sender"], email["thread_id"])
+                    relabels.append(("Chat", email["msg_id"]))
+                    self.logger.info(f"[Processor] Chat mode started for {email['sender']}")
                     continue
-                if self.chat_started and matched_command[0] == 'bye meep':
-                    self.chat_started = False
-                    await self.execute("inbox", "UPDATE emails SET type = ? WHERE msg_id = ?", ("Chat", email["msg_id"]))
-                    self.logger.info(f"[Processor] Chat mode ended")
+                if session and matched_command[0] == 'bye meep':
+                    self.sessions.end(conn, email["sender"])
+                    relabels.append(("Chat", email["msg_id"]))
+                    self.logger.info(f"[Processor] Chat mode ended for {email['sender']}")
                     continue
-            if self.chat_started:
-                await self.execute("inbox", "UPDATE emails SET type = ? WHERE msg_id = ?", ("Chat", email["msg_id"]))
+            if session:
+                self.sessions.touch(conn, session)
+                relabels.append(("Chat", email["msg_id"]))
                 self.logger.info(f"[Processor] Message \"{email['content']}\" labeled as chat")
                 continue
             
             # Command
             if first_line[0] == "!":
-                await self.execute("inbox", "UPDATE emails SET type = ? WHERE msg_id = ?", ("Command", email["msg_id"]))
+                relabels.append(("Command", email["msg_id"]))
                 self.logger.info(f"[Processor] Message \"{email['content']}\" labeled as command")
                 continue
             
-            await self.execute("inbox", "DELETE FROM emails WHERE msg_id = ?", (email["msg_id"],))
+            deletes.append((email["msg_id"],))
             self.logger.info(f"[Processor] Message \"{email['content']}\" ignored")
             continue
-        
-        await self._inbox.commit()
+
+        return relabels, deletes
+
+    def _sender_bucket(self, sender : str) -> TokenBucket:
+        bucket = self._sender_buckets.get(sender)
+        if bucket is None:
+            if len(self._sender_buckets) >= MAX_SENDER_BUCKETS:
+                # A full bucket is the same as a fresh one, so those can go
+                self._sender_buckets = {key: value for key, value in self._sender_buckets.items() if not value.is_full()}
+            bucket = self._sender_buckets[sender] = TokenBucket(self.sender_rate / 60, self.sender_burst)
+        return bucket
+
+    def _admit(self, emails, now_ms : int) -> tuple[list, list]:
+        """Apply the per sender rate limit, returns (admitted emails, (deferred_until, msg_id) parameters)"""
+        admitted = []
+        defers = []
+        excess = {}
+        for email in emails:
+            bucket = self._sender_bucket(email["sender"])
+            if bucket.try_acquire():
+                admitted.append(email)
+                continue
+            # Spread a sender's excess rows over the time its bucket needs to refill for them
+            excess[email["sender"]] = excess.get(email["sender"], 0) + 1
+            defers.append((now_ms + int(bucket.time_until(excess[email["sender"]]) * 1000), email["msg_id"]))
+
+        for sender, count in excess.items():
+            self.logger.warning(f"[Processor] {sender} is over {self.sender_rate} messages/min, deferred {count} message(s)")
+        return admitted, defers
+
+    async def classify_emails(self, chunk_size) -> None:
+        # Select, classify and relabel in a single hop to the database thread
+        def classify(conn : sqlite3.Connection):
+            now_ms = int(time.time() * 1000)
+            # Senders take turns so one flood cannot fill the batch, the commands lane decides who goes
+            # first within a turn. A sender's own rows go strictly in the order they were sent (chat
+            # mode depends on it), so nothing is read past a row that is still deferred.
+            emails = conn.execute(
+                fair_select("unconfirmed", """
+                    (deferred_until IS NULL OR deferred_until <= :now) AND NOT EXISTS (
+                        SELECT 1 FROM inbox AS earlier
+                        WHERE earlier.state = 'unconfirmed' AND earlier.sender = inbox.sender
+                        AND earlier.time_sent_ms < inbox.time_sent_ms AND earlier.deferred_until > :now
+                    )
+                """, order=SENT_ORDER),
+                {"now": now_ms, "limit": chunk_size}
+            ).fetchall()
+            admitted, defers = self._admit(emails, now_ms)
+            try:
+                relabels, deletes = self._classify(admitted, conn)
+                self.sessions.purge_expired(conn, now_ms)
+            except BaseException:
+                # The transaction rolls back, so must the cached sessions
+                self.sessions.invalidate()
+                raise
+            conn.executemany("UPDATE inbox SET deferred_until = ? WHERE msg_id = ?", defers)
+            conn.executemany("UPDATE inbox SET state = ? WHERE msg_id = ?", relabels)
+            conn.executemany("DELETE FROM inbox WHERE msg_id = ?", deletes)
+            return defers
+
+        defers = await self._db.run_in_transaction(classify)
+        if defers:
+            self.queue_stats["deferred"] += len(defers)
+            # Come back as soon as the first deferred row is due
+            due = (min(deferred_until for deferred_until, _ in defers) - time.time() * 1000) / 1000
+            asyncio.get_running_loop().call_later(max(0.0, due), self.inbox_ready.set)
 
     async def run_commands(self, chunk_size) -> None:
-        cursor = await self.execute("inbox", "SELECT * FROM emails WHERE type = 'Command' LIMIT ?", (chunk_size,))
-        if not cursor:
+        emails = await self._db.read(fair_select("Command"), {"limit": chunk_size})
+        if not emails:
             return
 
-        emails = await cursor.fetchall()
-        reply_drafts = []
+        reply_drafts, spooled = [], []
         for email in emails:
             message = email["content"].split("\n")
             command = message[0][1:]
@@ -268,48 +422,94 @@ class Processor:
                 # Route to correct command executer
                 match matched_command[0]:
                     case "notion":
-                        return_message = await self._notion.run_command("\n".join(message[1:]))
+                        # Rejected right away if invalid, otherwise run by the spool workers
+                        notion_command = "\n".join(message[1:])
+                        return_message = self._notion.check_command(notion_command)
+                        if not return_message:
+                            spooled.append((notion_command, email))
+                            return_message = "Queued: " + notion_command.replace("\n", " ") + "\nYou will get another reply once it is in Notion."
             
             if return_message:
                 reply_drafts.append((return_message, email))
         
-        await self.reply_emails(reply_drafts)
+        await self.reply_emails(reply_drafts, spooled)
 
     async def process_loop(self, stop_event : asyncio.Event, chunk_size):
-        state = "INACTIVE"
-        last_activity = time.time()
         self.logger.info("[Processor Loop] Initialized processor loop")
 
         try:
             while not stop_event.is_set():
-                # Check for work
-                cursor = await self.execute(
-                    "inbox", 
-                    "SELECT COUNT(*) as cnt FROM emails WHERE type IN ('unconfirmed', 'Command')"
-                )
-                if not cursor:
-                    continue
-                count = (await cursor.fetchone())["cnt"] # type: ignore
-
-                # INACTIVE MODE
-                if count == 0:
-                    # No new work for over one minute -> INACTIVE
-                    if state != "INACTIVE" and time.time() - last_activity > 1 * 60:
-                        self.logger.info("[Processor Loop] Switching to INACTIVE mode.")
-                        state = "INACTIVE"
-                    await asyncio.sleep(5)
-                    continue
+                self.scheduler.begin()
 
-                # There is work → ACTIVE
-                if count > 0 and state != "ACTIVE":
-                    self.logger.info("[Processor Loop] Switching to ACTIVE mode.")
-                    state = "ACTIVE"
+                # Check for work, on a reader so polling never waits on the writer.
+                # Also lets a throttled fetch loop resume once below the low watermark.
+                _, ready = await self.inbox_depth()
+                self.scheduler.record(ready > 0)
 
-                await self.classify_emails(chunk_size)
-                await self.run_commands(chunk_size)
-                last_activity = time.time()
+                if ready > 0:
+                    await self.classify_emails(chunk_size)
+                    await self.run_commands(chunk_size)
 
-                # Small delay to prevent tight loop
-                await asyncio.sleep(0.5)
+                # Backs off while idle, cut short by new emails
+                await self.scheduler.wait()
         except Exception as e:
             self.logger.exception(f"[Processor Loop] Unexpected error: {e}")
+
+# ----------------------------
+# Benchmark
+# ----------------------------
+
+async def _legacy_classify_emails(processor : Processor, chunk_size) -> None:
+    '''classify_emails before the unit of work API: one execute (and thread hop) per statement'''
+    cursor = await processor._db.execute("SELECT * FROM inbox WHERE state = 'unconfirmed' ORDER BY time_sent_ms LIMIT ?", (chunk_size,))
+    emails = await cursor.fetchall() # type: ignore
+    # Chat sessions are looked up on the database thread, one more hop
+    relabels, deletes = await processor._db._conn._execute(processor._classify, emails, processor._db._conn._conn)
+    for params in relabels:
+        await processor._db.execute("UPDATE inbox SET state = ? WHERE msg_id = ?", params)
+    for params in deletes:
+        await processor._db.execute("DELETE FROM inbox WHERE msg_id = ?", params)
+    await processor._db.commit()
+
+async def _benchmark(chunk_size = 10, rounds = 100):
+    # Count every event loop -> database thread hop
+    hops = 0
+    aiosqlite_execute = aiosqlite.Connection._execute
+    async def counting_execute(self, fn, *args, **kwargs):
+        nonlocal hops
+        hops += 1
+        return await aiosqlite_execute(self, fn, *args, **kwargs)
+    aiosqlite.Connection._execute = counting_execute
+
+    processor = Processor(logging.getLogger("Processor Benchmark"))
+    # Everything comes from one sender, keep the flood protection out of the measurement
+    processor.sender_rate = processor.sender_burst = 1_000_000
+    await processor.init_db()
+
+    for name, classify in [("per statement", _legacy_classify_emails), ("unit of work", Processor.classify_emails)]:
+        total_hops, elapsed = 0, 0.0
+        for i in range(rounds):
+            # half commands, half messages that get ignored
+            await processor.add_emails_to_inbox([{
+                "content": "!notion\nFinances\nadd\nMatcha\n8.23" if j % 2 else "just saying hi",
+                "time_sent": "", "time_seen": "", "time_sent_ms": i * chunk_size + j, "time_seen_ms": 0,
+                "sender": "bench", "subject": "SMS",
+                "msg_id": f"<{name}-{i}-{j}>", "thread_id": "", "gmail_msg_id": ""
+            } for j in range(chunk_size)])
+
+            hops = 0
+            start = time.perf_counter()
+            await classify(processor, chunk_size)
+            elapsed += time.perf_counter() - start
+            total_hops += hops
+
+        print(f"{name:>14}: {total_hops / rounds:5.1f} hops, {elapsed / rounds * 1000:6.2f} ms per batch of {chunk_size}")
+
+    await processor._db.close()
+
+if __name__ == "__main__":
+    # python -m tools.processor, runs against throwaway databases in a temp directory
+    import tempfile
+    os.chdir(tempfile.mkdtemp())
+    os.mkdir("memory")
+    asyncio.run(_benchmark())
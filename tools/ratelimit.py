@@ -0,0 +1,76 @@
+import time
+import random
+import asyncio
+import aiohttp
+
+# Statuses worth retrying: rate limited or a hiccup on the server's side
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Connection errors raised before the request went out, anything else may have been applied already
+NOT_SENT_ERRORS = (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError)
+
+'''
+TokenBucket:
+- rate: units added to the bucket per second
+- capacity: max units the bucket holds (the allowed burst)
+- stats: units acquired, how many acquires had to wait and for how long in total
+'''
+class TokenBucket:
+    def __init__(self, rate : float, capacity : float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.stats = {"acquired": 0, "throttled": 0, "wait_time": 0.0}
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        # Callers are served in FIFO order, so a big request cannot be starved by small ones
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, units : float = 1) -> float:
+        '''Wait until units are available and take them, returns the time spent waiting'''
+        units = min(units, self.capacity)
+        start = time.monotonic()
+        async with self._lock:
+            self._refill()
+            while self._tokens < units:
+                await asyncio.sleep((units - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= units
+
+        waited = time.monotonic() - start
+        self.stats["acquired"] += units
+        if waited > 0.001:
+            self.stats["throttled"] += 1
+            self.stats["wait_time"] += waited
+        return waited
+
+    def try_acquire(self, units : float = 1) -> bool:
+        '''Take units if they are available right now, never waits'''
+        self._refill()
+        if self._tokens < units:
+            return False
+        self._tokens -= units
+        self.stats["acquired"] += units
+        return True
+
+    def time_until(self, units : float = 1) -> float:
+        '''Seconds until units will be available, 0 if they already are'''
+        self._refill()
+        return max(0.0, (min(units, self.capacity) - self._tokens) / self.rate)
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self._tokens >= self.capacity
+
+    def drain(self) -> None:
+        '''Empty the bucket, e.g. after the server said we are going too fast'''
+        self._refill()
+        self._tokens = 0
+
+def backoff_delay(attempt : int, base : float = 0.5, cap : float = 30.0) -> float:
+    '''Exponential backoff with full jitter'''
+    return random.uniform(0, min(cap, base * 2 ** attempt))
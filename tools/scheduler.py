@@ -0,0 +1,76 @@
+import time
+import random
+import asyncio
+import logging
+from typing import Literal, Optional
+
+async def wait_for_event(event : asyncio.Event, timeout : float) -> bool:
+    """Sleep for up to timeout seconds, returns True if event was set in the meantime"""
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+'''
+PollScheduler: adaptive delay between the polls of a loop
+- name: loop name used in the logs
+- floor: delay between polls while there is work
+- ceiling: max delay between polls once the loop backed off
+- backoff: how much the delay grows after each empty poll
+- jitter: the delay is randomly stretched or shrunk by up to this fraction
+- wake_event: optional event cutting the current delay short (and resetting it to floor)
+- state: ACTIVE (found work on the last poll), IDLE (backing off) or INACTIVE (at the ceiling)
+- stats: poll counts and the current delay
+'''
+class PollScheduler:
+    def __init__(self, name : str, logger : logging.Logger, floor : float = 0.5, ceiling : float = 60, backoff : float = 2.0, jitter : float = 0.1, wake_event : Optional[asyncio.Event] = None) -> None:
+        self.name = name
+        self.logger : logging.Logger = logger
+        self.floor = floor
+        self.ceiling = ceiling
+        self.backoff = backoff
+        self.jitter = jitter
+        self.wake_event = wake_event
+        self.state : Literal["ACTIVE", "IDLE", "INACTIVE"] = "IDLE"
+        self.delay = floor
+        self.last_activity = time.time()
+        self.stats = {"polls": 0, "busy_polls": 0, "idle_polls": 0, "wakeups": 0}
+
+    def _set_state(self, state : Literal["ACTIVE", "IDLE", "INACTIVE"]) -> None:
+        # IDLE is just the ramp between the two, not worth a log line every burst
+        if state != self.state and state != "IDLE":
+            self.logger.info(f"[{self.name}] Switching to {state} mode.")
+        self.state = state
+
+    def begin(self) -> None:
+        """Call before checking for work, so a wake up arriving during the check is not lost"""
+        if self.wake_event:
+            self.wake_event.clear()
+
+    def record(self, has_work : bool) -> None:
+        """Report the outcome of a poll: work ramps straight back up, no work backs off"""
+        self.stats["polls"] += 1
+        if has_work:
+            self.stats["busy_polls"] += 1
+            self.last_activity = time.time()
+            self.delay = self.floor
+            self._set_state("ACTIVE")
+        else:
+            self.stats["idle_polls"] += 1
+            # The first empty poll after work keeps the short delay
+            if self.state != "ACTIVE":
+                self.delay = min(self.ceiling, self.delay * self.backoff)
+            self._set_state("INACTIVE" if self.delay >= self.ceiling else "IDLE")
+
+    async def wait(self) -> None:
+        """Sleep until the next poll is due, or until woken up"""
+        delay = self.delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+        if self.wake_event is None:
+            await asyncio.sleep(delay)
+        elif await wait_for_event(self.wake_event, delay):
+            self.stats["wakeups"] += 1
+            self.delay = self.floor
+
+    def metrics(self) -> dict:
+        return {"state": self.state, "delay": round(self.delay, 3), **self.stats}
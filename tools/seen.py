@@ -0,0 +1,94 @@
+import time
+import logging
+from collections import OrderedDict
+from tools.database import Database
+
+SEEN_CACHE_SIZE = 4096
+# Seen ids are kept this long, gmail would only list an older message again if it was marked unread by hand
+SEEN_RETENTION_MS = 30 * 24 * 60 * 60 * 1000
+# Give up removing UNREAD from a message after this many failed tries
+MAX_RELABEL_ATTEMPTS = 10
+
+'''
+SeenStore: gmail messages already ingested, so they are never downloaded twice
+- capacity: max gmail message ids kept in the LRU cache (seen or known to be unseen)
+- stats: cache hits/misses, messages skipped as duplicates, UNREAD removals retried
+- _cache: gmail_msg_id -> seen (bool), most recently used last
+
+Rows are written in the transaction that adds the emails to the inbox (see record()),
+so a message is marked seen exactly when it was queued.
+'''
+class SeenStore:
+    def __init__(self, db : Database, logger : logging.Logger, capacity : int = SEEN_CACHE_SIZE) -> None:
+        self.logger : logging.Logger = logger
+        self.capacity = capacity
+        self.stats = {"hits": 0, "misses": 0, "duplicates": 0, "relabeled": 0, "relabel_failures": 0}
+        self._db = db
+        self._cache : OrderedDict[str, bool] = OrderedDict()
+
+    def _remember(self, gmail_msg_id : str, seen : bool) -> None:
+        self._cache[gmail_msg_id] = seen
+        self._cache.move_to_end(gmail_msg_id)
+        if len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    async def filter_unseen(self, gmail_msg_ids : list) -> list:
+        """Drop the ids that were already ingested, one reader query for the ones not cached"""
+        unknown = [gmail_msg_id for gmail_msg_id in gmail_msg_ids if gmail_msg_id not in self._cache]
+        self.stats["hits"] += len(gmail_msg_ids) - len(unknown)
+        self.stats["misses"] += len(unknown)
+        if unknown:
+            rows = await self._db.read(
+                f"SELECT gmail_msg_id FROM seen WHERE gmail_msg_id IN ({', '.join('?' * len(unknown))})", tuple(unknown)
+            )
+            found = {row["gmail_msg_id"] for row in rows}
+            for gmail_msg_id in unknown:
+                self._remember(gmail_msg_id, gmail_msg_id in found)
+
+        unseen = [gmail_msg_id for gmail_msg_id in gmail_msg_ids if not self._cache.get(gmail_msg_id)]
+        if len(unseen) < len(gmail_msg_ids):
+            self.stats["duplicates"] += len(gmail_msg_ids) - len(unseen)
+            self.logger.info(f"[Seen] Skipped {len(gmail_msg_ids) - len(unseen)} already ingested message(s)")
+        return unseen
+
+    def record(self, emails) -> tuple:
+        """(query, params) marking emails as seen, for the batch that inserts them into the inbox. UNREAD is only removed after that commit, see relabeled()"""
+        now_ms = int(time.time() * 1000)
+        return (
+            "INSERT OR IGNORE INTO seen (gmail_msg_id, msg_id, seen_ms, unread_removed) VALUES (?, ?, ?, ?)",
+            [
+                (email_obj["gmail_msg_id"], email_obj["msg_id"], now_ms, 0)
+                for email_obj in emails
+            ]
+        )
+
+    def remember(self, emails) -> None:
+        """Update the cache once the record() batch committed"""
+        for email_obj in emails:
+            self._remember(email_obj["gmail_msg_id"], True)
+
+    async def pending_relabels(self, limit : int = 50) -> list:
+        """Seen messages whose UNREAD label could not be removed yet"""
+        rows = await self._db.read(
+            "SELECT gmail_msg_id FROM seen WHERE unread_removed = 0 AND attempts < ? ORDER BY seen_ms LIMIT ?",
+            (MAX_RELABEL_ATTEMPTS, limit)
+        )
+        return [row["gmail_msg_id"] for row in rows]
+
+    async def relabeled(self, done : list, failed : list) -> None:
+        await self._db.execute_batch([
+            ("UPDATE seen SET unread_removed = 1 WHERE gmail_msg_id = ?", [(gmail_msg_id,) for gmail_msg_id in done]),
+            ("UPDATE seen SET attempts = attempts + 1 WHERE gmail_msg_id = ?", [(gmail_msg_id,) for gmail_msg_id in failed])
+        ])
+        self.stats["relabeled"] += len(done)
+        self.stats["relabel_failures"] += len(failed)
+
+    async def prune(self) -> None:
+        """Forget seen messages past SEEN_RETENTION_MS, unless they still wait for a relabel"""
+        await self._db.execute_batch([(
+            "DELETE FROM seen WHERE seen_ms < ? AND (unread_removed = 1 OR attempts >= ?)",
+            [(int(time.time() * 1000) - SEEN_RETENTION_MS, MAX_RELABEL_ATTEMPTS)]
+        )])
+
+    def metrics(self) -> dict:
+        return {"cached": len(self._cache), **self.stats}
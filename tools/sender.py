@@ -0,0 +1,89 @@
+import os
+import uuid
+import socket
+import asyncio
+import logging
+import aiohttp
+from tools.gmail_async import AsyncGmail, GmailException
+from tools.processor import Processor
+from tools.ratelimit import backoff_delay, RETRY_STATUSES, NOT_SENT_ERRORS
+
+'''
+Sender:
+- worker_id: unique id this sender claims outbox leases under
+- concurrency: max replies in flight at once
+- max_retries: retries per reply on 429 and failed connects
+- lease_seconds: how long a claimed row stays ours, renewed before every retry
+- stats: sent/failed/retried replies, how many times gmail throttled us, and sends with an unknown outcome
+'''
+class Sender:
+    def __init__(self, gmail_client : AsyncGmail, processor : Processor, logger : logging.Logger, concurrency : int = 4, max_retries : int = 5, lease_seconds : float = 120) -> None:
+        self.logger : logging.Logger = logger
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.lease_seconds = lease_seconds
+        self.stats = {"sent": 0, "failed": 0, "retries": 0, "throttled": 0, "unknown": 0, "lost_leases": 0}
+        self._gmail = gmail_client
+        self._processor = processor
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def claim(self, chunk_size : int) -> list:
+        '''Lease outbox rows for this sender, see Processor.claim_outgoing_emails'''
+        return await self._processor.claim_outgoing_emails(self.worker_id, chunk_size, self.lease_seconds)
+
+    async def send(self, email_obj) -> bool:
+        '''Send one claimed reply, retrying with jittered backoff, and ack its outbox row once it went out'''
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    # The gmail client waits for enough quota units before sending
+                    await self._gmail.reply_message(email_obj)
+                    break
+                except GmailException as e:
+                    if e.status in RETRY_STATUSES and e.status != 429:
+                        # A 5xx may come after gmail sent the text: resending could text the user twice
+                        self.stats["failed"] += 1
+                        self.stats["unknown"] += 1
+                        self.logger.error(f"[Sender] Unknown outcome sending \"{email_obj['content']}\", not resending: {e}")
+                        await self._processor.release_outgoing_email(email_obj, self.worker_id, failed=True)
+                        return False
+                    if e.status == 429:
+                        self.stats["throttled"] += 1
+                    if e.status != 429 or attempt == self.max_retries:
+                        self.stats["failed"] += 1
+                        self.logger.error(f"[Sender] Failed to send \"{email_obj['content']}\": {e}")
+                        # Park rejected replies, give throttled ones back for a later retry
+                        await self._processor.release_outgoing_email(email_obj, self.worker_id, failed=e.status != 429)
+                        return False
+                except NOT_SENT_ERRORS as e:
+                    if attempt == self.max_retries:
+                        self.stats["failed"] += 1
+                        self.logger.error(f"[Sender] Failed to send \"{email_obj['content']}\": {e}")
+                        await self._processor.release_outgoing_email(email_obj, self.worker_id)
+                        return False
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    # Timed out or dropped after sending: resending could text the user twice,
+                    # so the row is parked as failed for a manual look instead
+                    self.stats["failed"] += 1
+                    self.stats["unknown"] += 1
+                    self.logger.error(f"[Sender] Unknown outcome sending \"{email_obj['content']}\", not resending: {type(e).__name__} {e}")
+                    await self._processor.release_outgoing_email(email_obj, self.worker_id, failed=True)
+                    return False
+
+                self.stats["retries"] += 1
+                await asyncio.sleep(backoff_delay(attempt))
+                # All the retries together can outlast the lease, renew it so no other worker sends this reply too
+                if not await self._processor.extend_outgoing_lease(email_obj, self.worker_id, self.lease_seconds):
+                    self.stats["lost_leases"] += 1
+                    self.logger.warning(f"[Sender] Lost the lease on \"{email_obj['content']}\", dropping the retry")
+                    return False
+
+        self.stats["sent"] += 1
+        await self._processor.ack_outgoing_email(email_obj, self.worker_id)
+        return True
+
+    async def send_all(self, emails) -> int:
+        '''Send claimed replies in parallel (up to concurrency at a time), returns how many went out'''
+        results = await asyncio.gather(*(self.send(email_obj) for email_obj in emails))
+        return sum(results)
@@ -0,0 +1,102 @@
+import time
+import sqlite3
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+# A chat session ends by itself after this long without a message from its sender
+SESSION_TTL_MS = 30 * 60 * 1000
+SESSION_CACHE_SIZE = 1024
+# How often expired sessions are deleted from the database
+PURGE_INTERVAL_MS = 5 * 60 * 1000
+
+'''
+SessionStore: per sender chat sessions, persisted in the sessions table and cached in memory
+- ttl_ms: idle time after which a session expires
+- capacity: max senders kept in the LRU cache (including senders known to have no session)
+- stats: cache hits/misses/evictions and expired sessions
+- _cache: sender -> session row (dict) or None, most recently used last
+
+All methods take the sqlite3 connection of the current unit of work (see Database.run_in_transaction),
+so a cache miss is one indexed lookup inside a transaction that already runs, not an extra round trip.
+The cache is only written through these methods, so call invalidate() if that transaction rolls back.
+'''
+class SessionStore:
+    def __init__(self, logger : logging.Logger, ttl_ms : int = SESSION_TTL_MS, capacity : int = SESSION_CACHE_SIZE) -> None:
+        self.logger : logging.Logger = logger
+        self.ttl_ms = ttl_ms
+        self.capacity = capacity
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+        self._cache : OrderedDict[str, Optional[dict]] = OrderedDict()
+        self._last_purge = 0
+
+    def _remember(self, sender : str, session : Optional[dict]) -> None:
+        self._cache[sender] = session
+        self._cache.move_to_end(sender)
+        if len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def get(self, conn : sqlite3.Connection, sender : str, now_ms : Optional[int] = None) -> Optional[dict]:
+        """The live session of sender, or None"""
+        now_ms = now_ms or int(time.time() * 1000)
+        if sender in self._cache:
+            self.stats["hits"] += 1
+            self._cache.move_to_end(sender)
+            session = self._cache[sender]
+        else:
+            self.stats["misses"] += 1
+            row = conn.execute(
+                "SELECT sender, thread_id, mode, started_ms, expires_ms FROM sessions WHERE sender = ?", (sender,)
+            ).fetchone()
+            session = dict(zip(["sender", "thread_id", "mode", "started_ms", "expires_ms"], row)) if row else None
+            self._remember(sender, session)
+
+        if session and session["expires_ms"] <= now_ms:
+            self.stats["expired"] += 1
+            self.logger.info(f"[Sessions] Chat session of {sender} expired")
+            self.end(conn, sender)
+            return None
+        return session
+
+    def start(self, conn : sqlite3.Connection, sender : str, thread_id : str, now_ms : Optional[int] = None) -> dict:
+        now_ms = now_ms or int(time.time() * 1000)
+        session = {"sender": sender, "thread_id": thread_id, "mode": "Chat", "started_ms": now_ms, "expires_ms": now_ms + self.ttl_ms}
+        conn.execute(
+            "INSERT OR REPLACE INTO sessions (sender, thread_id, mode, started_ms, expires_ms) VALUES (?, ?, ?, ?, ?)",
+            (sender, thread_id, session["mode"], now_ms, session["expires_ms"])
+        )
+        self._remember(sender, session)
+        return session
+
+    def touch(self, conn : sqlite3.Connection, session : dict, now_ms : Optional[int] = None) -> None:
+        """Push the expiry of a session back, called for every message that is part of it"""
+        now_ms = now_ms or int(time.time() * 1000)
+        session["expires_ms"] = now_ms + self.ttl_ms
+        conn.execute("UPDATE sessions SET expires_ms = ? WHERE sender = ?", (session["expires_ms"], session["sender"]))
+
+    def end(self, conn : sqlite3.Connection, sender : str) -> None:
+        conn.execute("DELETE FROM sessions WHERE sender = ?", (sender,))
+        self._remember(sender, None)
+
+    def purge_expired(self, conn : sqlite3.Connection, now_ms : Optional[int] = None) -> int:
+        """Delete expired sessions, at most once per PURGE_INTERVAL_MS. Returns how many went."""
+        now_ms = now_ms or int(time.time() * 1000)
+        if now_ms - self._last_purge < PURGE_INTERVAL_MS:
+            return 0
+        self._last_purge = now_ms
+        purged = conn.execute("DELETE FROM sessions WHERE expires_ms <= ?", (now_ms,)).rowcount
+        if purged:
+            self.stats["expired"] += purged
+            # Cached copies of those sessions would already read as expired, just drop them
+            for sender in [key for key, value in self._cache.items() if value and value["expires_ms"] <= now_ms]:
+                self._cache[sender] = None
+            self.logger.info(f"[Sessions] Purged {purged} expired chat session(s)")
+        return purged
+
+    def invalidate(self) -> None:
+        """Forget the cache, e.g. after the transaction that wrote to it rolled back"""
+        self._cache.clear()
+
+    def metrics(self) -> dict:
+        return {"cached": len(self._cache), **self.stats}
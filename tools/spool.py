@@ -0,0 +1,249 @@
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+import logging
+from typing import Optional
+from tools.database import Database
+from tools.notion import Notion, NotionUnavailableException, NotionUnknownOutcomeException
+from tools.ratelimit import backoff_delay
+from tools.scheduler import PollScheduler
+
+# Writes run at once, Notion's client rate limits and caps the requests in flight anyway
+SPOOL_WORKERS = 3
+# A worker that died mid-write loses its claim after this long (longer than a request with all its retries)
+SPOOL_LEASE_SECONDS = 300
+# Tries on an unreachable Notion before the command is given up on and the sender told so
+MAX_SPOOL_ATTEMPTS = 8
+# Finished entries are kept this long, so a message delivered again is not applied again
+SPOOL_RETENTION_MS = 7 * 24 * 60 * 60 * 1000
+SPOOL_PRUNE_INTERVAL = 60 * 60
+# Wait at least this long before looking up a write with an unknown outcome, it may still be in flight at Notion
+UNKNOWN_OUTCOME_DELAY = 30
+
+'''
+NotionSpool: durable queue of Notion writes, drained by background workers
+- worker_id: unique id this process claims spool leases under
+- workers: max entries run at once
+- max_attempts: tries before an entry fails for good
+- ready: set whenever entries are queued, wakes up run()
+- stats: entries queued/done/failed, retries after Notion was unreachable, writes found
+  already applied, writes with an unknown outcome, leases lost
+
+Entries are keyed by key(msg_id) and inserted in the transaction that replies "queued"
+(see enqueue()), so a command is either spooled and acknowledged or neither. The result
+is queued in the outbox in the transaction that marks its entry done, as its own row
+replying to the original message.
+
+The key is also written into the page (the datasource's idempotency_property), and an
+entry run again is first looked up in Notion, so a write that timed out is not applied
+twice. Without an idempotency_property a write with an unknown outcome (or one whose worker
+died mid-write) fails instead of being retried.
+'''
+class NotionSpool:
+    def __init__(self, db : Database, notion : Notion, logger : logging.Logger, reply_ready : Optional[asyncio.Event] = None, workers : int = SPOOL_WORKERS, max_attempts : int = MAX_SPOOL_ATTEMPTS) -> None:
+        self.logger : logging.Logger = logger
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.ready : asyncio.Event = asyncio.Event()
+        self.scheduler = PollScheduler("Notion Spool", logger, floor=0.5, ceiling=30, wake_event=self.ready)
+        self.stats = {"queued": 0, "done": 0, "failed": 0, "retries": 0, "found": 0, "unknown_outcome": 0, "lost_leases": 0}
+        self._db = db
+        self._notion = notion
+        self._reply_ready = reply_ready
+        self._last_prune = 0.0
+
+    @staticmethod
+    def key(msg_id : str) -> str:
+        """Idempotency key of the command sent in message msg_id"""
+        return f"notion:{msg_id}"
+
+    def enqueue(self, commands) -> tuple:
+        """(query, params) spooling (command, email) pairs, for the batch that replies "queued" """
+        now_ms = int(time.time() * 1000)
+        return (
+            """
+            INSERT OR IGNORE INTO notion_spool
+            (idempotency_key, command, time_sent, sender, subject, msg_id, thread_id, gmail_msg_id, time_sent_ms, queued_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    self.key(email_obj["msg_id"]),
+                    command,
+                    email_obj["time_sent"],
+                    email_obj["sender"],
+                    email_obj["subject"],
+                    email_obj["msg_id"],
+                    email_obj["thread_id"],
+                    email_obj["gmail_msg_id"],
+                    email_obj["time_sent_ms"],
+                    now_ms
+                )
+                for command, email_obj in commands
+            ]
+        )
+
+    def queued(self, commands) -> None:
+        """Call once the enqueue() batch committed"""
+        if commands:
+            self.stats["queued"] += len(commands)
+            self.ready.set()
+
+    async def claim(self, chunk_size : int) -> list:
+        """Lease up to chunk_size due entries, including the ones whose worker died mid-write (taken_over set)"""
+        now = int(time.time() * 1000)
+        entries = await self._db.run_in_transaction(lambda conn: conn.execute(
+            """
+            UPDATE notion_spool
+            SET status = 'running', lease_owner = ?, lease_expires = ?, attempts = attempts + 1, taken_over = (status = 'running')
+            WHERE idempotency_key IN (
+                SELECT idempotency_key FROM notion_spool
+                WHERE (status = 'pending' AND next_attempt_ms <= ?) OR (status = 'running' AND lease_expires < ?)
+                ORDER BY next_attempt_ms
+                LIMIT ?
+            )
+            RETURNING *
+            """,
+            (self.worker_id, now + SPOOL_LEASE_SECONDS * 1000, now, now, chunk_size)
+        ).fetchall())
+        return entries or []
+
+    async def finish(self, entry, result : str, failed : bool = False) -> bool:
+        """Mark a claimed entry done (or failed) and queue result as the reply, False if the lease was lost"""
+        def unit_of_work(conn : sqlite3.Connection) -> bool:
+            finished_ms = int(time.time() * 1000)
+            updated = conn.execute(
+                """
+                UPDATE notion_spool SET status = ?, result = ?, finished_ms = ?, lease_owner = NULL, lease_expires = NULL
+                WHERE idempotency_key = ? AND lease_owner = ?
+                """,
+                ("failed" if failed else "done", result, finished_ms, entry["idempotency_key"], self.worker_id)
+            ).rowcount
+            if updated:
+                # Keyed by the spool entry: the "queued" reply may still sit in the outbox under msg_id.
+                # Sorted by when it finished and held back until the "queued" reply went out (see
+                # Processor.claim_outgoing_emails), so the sender gets the two in order
+                conn.execute(
+                    """
+                    INSERT OR IGNORE INTO outbox
+                    (content, time_sent, sender, subject, msg_id, thread_id, gmail_msg_id, time_sent_ms, reply_to)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        result, entry["time_sent"], entry["sender"], entry["subject"], entry["idempotency_key"],
+                        entry["thread_id"], entry["gmail_msg_id"], finished_ms, entry["msg_id"]
+                    )
+                )
+            return bool(updated)
+
+        if not await self._db.run_in_transaction(unit_of_work):
+            self.stats["lost_leases"] += 1
+            self.logger.warning(f"[Notion Spool] Lost the lease on {entry['idempotency_key']} before finishing it")
+            return False
+        self.stats["failed" if failed else "done"] += 1
+        if self._reply_ready:
+            self._reply_ready.set()
+        return True
+
+    async def retry_later(self, entry, error : str, min_delay : float = 0) -> None:
+        """Give a claimed entry back with a backoff, or fail it once it ran out of attempts"""
+        if entry["attempts"] >= self.max_attempts:
+            self.logger.error(f"[Notion Spool] Giving up on {entry['idempotency_key']} after {entry['attempts']} tries: {error}")
+            await self.finish(entry, f"Command: {entry['command'].replace(chr(10), ' ')}\nError: Notion is unavailable, gave up after {entry['attempts']} tries.", failed=True)
+            return
+
+        delay = max(min_delay, backoff_delay(entry["attempts"], base=2, cap=300))
+        self.stats["retries"] += 1
+        self.logger.warning(f"[Notion Spool] Retrying {entry['idempotency_key']} in {delay:.1f}s: {error}")
+        await self._db.execute_batch([(
+            """
+            UPDATE notion_spool SET status = 'pending', next_attempt_ms = ?, result = ?, lease_owner = NULL, lease_expires = NULL
+            WHERE idempotency_key = ? AND lease_owner = ?
+            """,
+            [(int((time.time() + delay) * 1000), error, entry["idempotency_key"], self.worker_id)]
+        )])
+        # Come back once it is due, the scheduler may be backed off for longer
+        asyncio.get_running_loop().call_later(delay, self.ready.set)
+
+    async def unconfirmed(self, entry, error : str) -> None:
+        """Fail an entry whose write may or may not be in Notion, running it again could apply it twice"""
+        self.stats["unknown_outcome"] += 1
+        self.logger.error(f"[Notion Spool] {entry['idempotency_key']} may or may not be in Notion, not retrying: {error}")
+        await self.finish(entry, "Command: " + entry["command"].replace("\n", " ") + "\nError: Notion did not confirm the write, check whether it was added before sending it again.", failed=True)
+
+    async def run_entry(self, entry) -> None:
+        key, command = entry["idempotency_key"], entry["command"]
+        try:
+            # An earlier try may have reached Notion (unknown outcome, or its worker died mid-write)
+            if entry["attempts"] > 1 and await self._notion.find_command(command, key):
+                self.stats["found"] += 1
+                self.logger.info(f"[Notion Spool] {key} is already in Notion, not adding it again")
+                await self.finish(entry, "Command: " + command.replace("\n", " ") + "\nSuccess")
+                return
+            if entry["taken_over"] and not self._notion.can_find_command(command):
+                await self.unconfirmed(entry, "its worker died mid-write")
+                return
+            result = await self._notion.run_command(command, key)
+        except NotionUnknownOutcomeException as e:
+            if self._notion.can_find_command(command):
+                # Looked up before the next try
+                self.stats["unknown_outcome"] += 1
+                await self.retry_later(entry, str(e), min_delay=UNKNOWN_OUTCOME_DELAY)
+            else:
+                await self.unconfirmed(entry, str(e))
+            return
+        except NotionUnavailableException as e:
+            await self.retry_later(entry, str(e))
+            return
+        except Exception as e:
+            self.logger.exception(f"[Notion Spool] Unexpected error running {entry['idempotency_key']}: {e}")
+            await self.retry_later(entry, str(e))
+            return
+        await self.finish(entry, result)
+
+    async def prune(self) -> None:
+        """Forget finished entries past SPOOL_RETENTION_MS"""
+        await self._db.execute_batch([(
+            "DELETE FROM notion_spool WHERE status IN ('done', 'failed') AND finished_ms < ?",
+            [(int(time.time() * 1000) - SPOOL_RETENTION_MS,)]
+        )])
+
+    async def depth(self) -> dict:
+        """Entries per status"""
+        rows = await self._db.read("SELECT status, COUNT(*) AS count FROM notion_spool GROUP BY status")
+        return {row["status"]: row["count"] for row in rows}
+
+    async def run(self, stop_event : asyncio.Event) -> None:
+        """Drain the spool until stop_event is set, woken up whenever commands are queued"""
+        self.logger.info("[Notion Spool] Initialized notion spool loop")
+
+        try:
+            while not stop_event.is_set():
+                # Off the processor path: a changed config may take a while to set up, commands for
+                # new endpoints are accepted (Notion.check_command) once it is in use
+                try:
+                    await self._notion.reload_config()
+                except Exception as e:
+                    self.logger.exception(f"[Notion Spool] Reloading the Notion config failed: {e}")
+
+                self.scheduler.begin()
+                entries = await self.claim(self.workers)
+                self.scheduler.record(bool(entries))
+
+                if entries:
+                    await asyncio.gather(*(self.run_entry(entry) for entry in entries))
+
+                if time.monotonic() - self._last_prune > SPOOL_PRUNE_INTERVAL:
+                    self._last_prune = time.monotonic()
+                    await self.prune()
+
+                await self.scheduler.wait()
+        except Exception as e:
+            self.logger.exception(f"[Notion Spool] Unexpected error: {e}")
+
+    def metrics(self) -> dict:
+        return dict(self.stats)